@@ -1,5 +1,52 @@
+import argparse
+import asyncio
+import bisect
+import calendar
+import cProfile
+import csv
+import functools
+import heapq
+import io
 import json
+import math
+import operator
 import os
+import pstats
+import re
+import shutil
+import sqlite3
+import threading
+import time
+import tracemalloc
+import zlib
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+  import msvcrt
+from array import array
+from collections import Counter
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import chain, compress, islice, repeat
+from urllib.request import pathname2url
+
+"""
+Results reported for each line by the batch methods `Register.add_products` and `Register.sell_products`.
+RESULT_NOT_APPLIED is reported for the valid lines of an atomic batch that was rejected because of other lines.
+RESULT_ERROR is reported by RegisterServer for the events of a batch that could not be applied or persisted.
+"""
+RESULT_OK = "ok"
+RESULT_UNKNOWN_PRODUCT = "unknown product"
+RESULT_INSUFFICIENT_STOCK = "insufficient stock"
+RESULT_INVALID = "invalid"
+RESULT_VERSION_CONFLICT = "version conflict"
+RESULT_NO_SELL_PRICE = "no selling price"
+RESULT_NOT_APPLIED = "not applied"
+RESULT_ERROR = "error"
 
 """
     The Product class manages information related to a product in the vegan product store inventory.
@@ -19,10 +66,14 @@ import os
     quantity (int, optional): Available quantity in stock. Default: None.
     buy_price (float, optional): Purchase price of the product. Default: None.
     sell_price (float, optional): Selling price of the product. Default: None.
+
+    The attributes are declared in `__slots__`, so a Product does not carry its own dictionary of attributes.
 """
 
 class Product:
 
+  __slots__ = ("_name", "_quantity", "_buy_price", "_sell_price")
+
   def __init__(self, name=None, quantity=None, buy_price=None, sell_price=None):
     self._name = name
     self._quantity = quantity
@@ -52,6 +103,1288 @@ class Product:
     return self._sell_price
 
 
+"""
+    The InventoryStore class is a compact alternative to the dictionary of dictionaries used as warehouse register.
+    Instead of two dictionaries per product, it keeps one row per product in parallel typed columns
+    and a dictionary from product name to row number.
+    It behaves like the usual warehouse register dictionary: `store[name]` returns a StockRow,
+    which can be read and changed like the {'quantity', 'buy_price', 'sell_price', 'version'} dictionary of the product.
+
+    Instance attributes:
+    _index (dict): product name -> row number.
+    _names (list): product name of each row.
+    _quantities (array of int): quantity of each row.
+    _buy_prices (array of float): purchase price of each row, NaN if the product has no purchase price.
+    _sell_prices (array of float): selling price of each row, NaN if the product has no selling price.
+    _versions (array of int): version of each row (see Register shared mode), 0 if the product has no version.
+
+    Methods:
+    __init__(self, warehouse_reg=None):
+    Constructor of the class. Copies the products of `warehouse_reg` (a dictionary in the usual format), if given.
+
+    columns(self):
+    Returns the tuple (names, quantities, buy_prices, sell_prices) with the columns themselves, without copies,
+    for whole-stock scans.
+
+    to_dict(self):
+    Returns the register as the usual dictionary of dictionaries, for example to save it in JSON format.
+
+    Removing a product moves the last row in its place, so StockRow objects obtained before a removal should not be reused.
+    Setting a product with a value that does not fit its column (a float quantity, or a quantity above MAX_QUANTITY,
+    the largest 64-bit integer) raises TypeError or OverflowError and leaves the store as it was:
+    a new row is removed again, and the previous values of an existing row are restored.
+"""
+
+class InventoryStore(MutableMapping):
+
+  FIELDS = ("quantity", "buy_price", "sell_price", "version")
+  MAX_QUANTITY = 2 ** 63 - 1
+
+  def __init__(self, warehouse_reg=None):
+    self._index = {}
+    self._names = []
+    self._quantities = array("q")
+    self._buy_prices = array("d")
+    self._sell_prices = array("d")
+    self._versions = array("q")
+    if warehouse_reg:
+      self.update(warehouse_reg)
+
+  def __getitem__(self, product_name):
+      return StockRow(self, self._index[product_name])
+
+  def __setitem__(self, product_name, data):
+      row = self._index.get(product_name)
+      old_values = None
+      if row is None:
+        row = len(self._names)
+        self._index[product_name] = row
+        self._names.append(product_name)
+        self._quantities.append(0)
+        self._buy_prices.append(math.nan)
+        self._sell_prices.append(math.nan)
+        self._versions.append(0)
+      else:
+        old_values = (self._quantities[row], self._buy_prices[row], self._sell_prices[row], self._versions[row])
+      try:
+        self._quantities[row] = data.get('quantity', 0)
+        self._buy_prices[row] = _price_or_nan(data.get('buy_price'))
+        self._sell_prices[row] = _price_or_nan(data.get('sell_price'))
+        self._versions[row] = data.get('version', 0)
+      except BaseException:
+        if old_values is None:
+          del self[product_name]
+        else:
+          self._quantities[row], self._buy_prices[row], self._sell_prices[row], self._versions[row] = old_values
+        raise
+
+  def __delitem__(self, product_name):
+      row = self._index.pop(product_name)
+      last_row = len(self._names) - 1
+      if row != last_row:
+        last_name = self._names[last_row]
+        self._names[row] = last_name
+        self._quantities[row] = self._quantities[last_row]
+        self._buy_prices[row] = self._buy_prices[last_row]
+        self._sell_prices[row] = self._sell_prices[last_row]
+        self._versions[row] = self._versions[last_row]
+        self._index[last_name] = row
+      self._names.pop()
+      self._quantities.pop()
+      self._buy_prices.pop()
+      self._sell_prices.pop()
+      self._versions.pop()
+
+  def __contains__(self, product_name):
+      return product_name in self._index
+
+  def __iter__(self):
+      return iter(self._names)
+
+  def __len__(self):
+      return len(self._names)
+
+  def columns(self):
+      return self._names, self._quantities, self._buy_prices, self._sell_prices
+
+  def to_dict(self):
+      return {product_name: dict(StockRow(self, row)) for row, product_name in enumerate(self._names)}
+
+  def __repr__(self):
+      return repr(self.to_dict())
+
+
+def _price_or_nan(price):
+    return math.nan if price is None else price
+
+
+def _nonzero_or_nan(value):
+    return value if value else math.nan
+
+
+"""
+    The StockRow class is the view of a single product of an InventoryStore, returned by `store[name]`.
+    It reads and writes the columns of the store directly, so `row['quantity'] -= 1` changes the store.
+    The keys are the ones of the usual register: 'quantity', 'buy_price', 'sell_price' and 'version';
+    a price that was never registered, or a version equal to 0, is not present, as in the dictionary format.
+"""
+
+class StockRow(MutableMapping):
+
+  __slots__ = ("_store", "_row")
+
+  def __init__(self, store, row):
+    self._store = store
+    self._row = row
+
+  def _column(self, key):
+      if key == 'quantity':
+        return self._store._quantities
+      if key == 'buy_price':
+        return self._store._buy_prices
+      if key == 'sell_price':
+        return self._store._sell_prices
+      if key == 'version':
+        return self._store._versions
+      raise KeyError(key)
+
+  def __getitem__(self, key):
+      value = self._column(key)[self._row]
+      if key == 'version' and value == 0:
+        raise KeyError(key)
+      if key in ('buy_price', 'sell_price') and math.isnan(value):
+        raise KeyError(key)
+      return value
+
+  def __setitem__(self, key, value):
+      self._column(key)[self._row] = value
+
+  def __delitem__(self, key):
+      if key == 'quantity' or key not in self:
+        raise KeyError(key)
+      self._column(key)[self._row] = 0 if key == 'version' else math.nan
+
+  def __iter__(self):
+      return (key for key in InventoryStore.FIELDS if key in self)
+
+  def __contains__(self, key):
+      try:
+        self[key]
+      except KeyError:
+        return False
+      return True
+
+  def __len__(self):
+      return sum(1 for _ in self)
+
+  def __repr__(self):
+      return repr(dict(self))
+
+
+"""
+    The LazyStore class is a warehouse register that reads the products from the JSON snapshot only when they are used.
+
+    The snapshot is written by `write_snapshot` with the position of every product in the file, and `save_index` saves
+    these positions in a compact binary index next to the snapshot (a header line, the names separated by NUL bytes,
+    then arrays of offsets, lengths and the alphabetical order of the names). At startup only the index is read:
+    `store[name]` finds the product with a binary search on the names, reads and parses only its own bytes from the
+    snapshot and keeps it in memory, so changes made to the returned dictionary stay in the store.
+    The index is valid only for the snapshot it was written with (same inode, modification time and size);
+    otherwise `attach` returns False and the register must be loaded as usual.
+
+    Instance attributes:
+    _loaded (dict): products read from the snapshot, added or changed, product name -> data.
+    _added (dict): products not present in the snapshot, in insertion order.
+    _deleted (set): products of the snapshot that were removed.
+    _snapshot (file): the snapshot opened in binary mode, None if the store has no index.
+    _names (list): product names in the order of the snapshot.
+    _offsets / _lengths (array of int): position and length of the data of each product in the snapshot.
+    _sorted_names (list) / _sorted_positions (array of int): the names in alphabetical order and their position in _names.
+    _materialized (bool): True if all the products of the snapshot are in _loaded.
+    _written (tuple): (names, offsets, lengths) of the last snapshot written by `write_snapshot`.
+
+    Methods:
+    __init__(self, warehouse_reg=None):
+    Constructor of the class. Copies the products of `warehouse_reg` (a dictionary in the usual format), if given.
+
+    attach(self, snapshot_filename, index_filename, snapshot_stamp):
+    Reads the index and opens the snapshot. Returns False, leaving the store unchanged, if the index
+    is missing, damaged or written for a different snapshot.
+
+    is_indexed(self):
+    Returns True if the store is attached to a snapshot.
+
+    materialize(self):
+    Reads all the remaining products with a single parse of the snapshot, before a whole-catalog operation.
+
+    write_snapshot(self, json_file):
+    Writes the whole register as compact JSON. The products that were never read are copied from the old snapshot
+    as they are, without parsing them.
+
+    save_index(self, snapshot_filename, index_filename, snapshot_stamp):
+    Saves the index of the snapshot just written by `write_snapshot` and attaches the store to the new snapshot.
+
+    close(self):
+    Closes the snapshot file.
+"""
+
+class LazyStore(MutableMapping):
+
+  def __init__(self, warehouse_reg=None):
+    self._loaded = {}
+    self._added = {}
+    self._deleted = set()
+    self._snapshot = None
+    self._names = []
+    self._offsets = array("q")
+    self._lengths = array("q")
+    self._sorted_names = []
+    self._sorted_positions = array("q")
+    self._materialized = True
+    self._written = None
+    if warehouse_reg:
+      self.update(warehouse_reg)
+
+  def _position(self, product_name):
+      sorted_index = bisect.bisect_left(self._sorted_names, product_name)
+      if sorted_index < len(self._sorted_names) and self._sorted_names[sorted_index] == product_name:
+        return self._sorted_positions[sorted_index]
+      return None
+
+  def __getitem__(self, product_name):
+      data = self._loaded.get(product_name)
+      if data is not None:
+        return data
+      if self._materialized or product_name in self._deleted:
+        raise KeyError(product_name)
+      position = self._position(product_name)
+      if position is None:
+        raise KeyError(product_name)
+      self._snapshot.seek(self._offsets[position])
+      data = json.loads(self._snapshot.read(self._lengths[position]))
+      self._loaded[product_name] = data
+      return data
+
+  def __setitem__(self, product_name, data):
+      if product_name not in self._loaded and self._position(product_name) is None:
+        self._added[product_name] = True
+      self._deleted.discard(product_name)
+      self._loaded[product_name] = data
+
+  def __delitem__(self, product_name):
+      if product_name not in self:
+        raise KeyError(product_name)
+      self._loaded.pop(product_name, None)
+      if self._added.pop(product_name, None) is None:
+        self._deleted.add(product_name)
+
+  def __contains__(self, product_name):
+      if product_name in self._added:
+        return True
+      return product_name not in self._deleted and self._position(product_name) is not None
+
+  def __iter__(self):
+      for product_name in self._names:
+        if product_name not in self._deleted:
+          yield product_name
+      yield from list(self._added)
+
+  def __len__(self):
+      return len(self._names) - len(self._deleted) + len(self._added)
+
+  def __repr__(self):
+      return f"LazyStore({len(self)} products, {len(self._loaded)} loaded)"
+
+  def is_indexed(self):
+      return self._snapshot is not None
+
+  def attach(self, snapshot_filename, index_filename, snapshot_stamp):
+      try:
+        with open(index_filename, "rb") as index_file:
+          header = json.loads(index_file.readline())
+          if tuple(header["snapshot"]) != tuple(snapshot_stamp):
+            return False
+          count = header["count"]
+          names_blob = index_file.read(header["names_bytes"])
+          columns = []
+          for _ in range(3):
+            column = array("q")
+            column.frombytes(index_file.read(count * column.itemsize))
+            columns.append(column)
+      except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+      names = names_blob.decode("utf-8").split("\0") if count else []
+      if len(names) != count or any(len(column) != count for column in columns):
+        return False
+
+      self.close()
+      self._snapshot = open(snapshot_filename, "rb")
+      self._names = names
+      self._offsets, self._lengths, self._sorted_positions = columns
+      self._sorted_names = [names[position] for position in self._sorted_positions]
+      self._loaded = {}
+      self._added = {}
+      self._deleted = set()
+      self._materialized = False
+      return True
+
+  def materialize(self):
+      if self._materialized:
+        return
+      self._snapshot.seek(0)
+      for product_name, data in json.load(self._snapshot).items():
+        if product_name not in self._deleted:
+          self._loaded.setdefault(product_name, data)
+      self._materialized = True
+
+  def write_snapshot(self, json_file):
+      old_snapshot = None
+      if not self._materialized:
+        self._snapshot.seek(0)
+        old_snapshot = self._snapshot.read()
+
+      names = []
+      offsets = array("q")
+      lengths = array("q")
+      position = 1
+      json_file.write("{")
+      snapshot_products = ((product_name, old_position) for old_position, product_name in enumerate(self._names)
+                           if product_name not in self._deleted)
+      added_products = ((product_name, None) for product_name in list(self._added))
+      for product_name, old_position in chain(snapshot_products, added_products):
+        data = self._loaded.get(product_name)
+        if data is None:
+          old_offset = self._offsets[old_position]
+          value = old_snapshot[old_offset:old_offset + self._lengths[old_position]].decode("ascii")
+        else:
+          value = json.dumps(data, separators=(",", ":"))
+        key = ("," if names else "") + json.dumps(product_name) + ":"
+        json_file.write(key)
+        json_file.write(value)
+        names.append(product_name)
+        offsets.append(position + len(key))
+        lengths.append(len(value))
+        position += len(key) + len(value)
+      json_file.write("}")
+      self._written = (names, offsets, lengths)
+
+  def save_index(self, snapshot_filename, index_filename, snapshot_stamp):
+      names, offsets, lengths = self._written
+      sorted_positions = array("q", sorted(range(len(names)), key=names.__getitem__))
+      names_blob = "\0".join(names).encode("utf-8")
+      header = {"snapshot": list(snapshot_stamp), "count": len(names), "names_bytes": len(names_blob)}
+
+      def write_index(index_file):
+          index_file.write(json.dumps(header).encode("ascii") + b"\n")
+          index_file.write(names_blob)
+          for column in (offsets, lengths, sorted_positions):
+            column.tofile(index_file)
+
+      _replace_file_atomically(index_filename, write_index, mode="wb")
+      self._written = None
+      self.attach(snapshot_filename, index_filename, snapshot_stamp)
+
+  def close(self):
+      if self._snapshot is not None:
+        self._snapshot.close()
+        self._snapshot = None
+
+
+"""
+    The ProductIndex class answers searches on the product names without scanning the whole warehouse.
+    Searches ignore upper and lower case.
+
+    Instance attributes:
+    _names (dict): lower case name -> product name.
+    _sorted_keys (list): lower case names in alphabetical order, searched with bisect for prefixes.
+    _trigrams (dict): trigram (3 consecutive characters of the lower case name, padded with spaces) -> set of lower case names.
+    _trigram_counts (dict): lower case name -> number of its trigrams.
+
+    Methods:
+    add(self, product_name) / remove(self, product_name):
+    Update the index for a single product; adding a name already present does nothing.
+    The constructor sorts all the names once, `add` inserts a single name in the sorted list.
+
+    starting_with(self, prefix, limit=10):
+    Returns up to `limit` product names starting with `prefix`, in alphabetical order.
+
+    closest(self, name, limit=5, min_similarity=0.3):
+    Returns up to `limit` product names similar to `name` (for example "Tofu" for "Tofuu"), most similar first.
+    The candidates are the names sharing trigrams with `name`, starting from the rarest trigrams and stopping
+    at MAX_CANDIDATES names. When even the rarest trigram is shared by more names, at most MAX_SCANNED of its names
+    are narrowed down to the ones also sharing the next rarest trigrams (set intersections), and at most MAX_CANDIDATES
+    of them are kept, so the cost of a search does not grow with the catalog.
+    The names that are a prefix of `name` or start with it are always candidates, so "Tofuu" finds "Tofu".
+    The common trigrams of the candidates are counted by intersecting the candidates with each trigram set,
+    and the candidates are ranked by the share of common trigrams (Jaccard similarity).
+    Iterating the index gives the product names it contains.
+"""
+
+class ProductIndex:
+
+  MAX_CANDIDATES = 200
+  MAX_SCANNED = 3000
+
+  def __init__(self, product_names=()):
+    self._names = {}
+    self._trigrams = {}
+    self._trigram_counts = {}
+    for product_name in product_names:
+      self._insert(product_name)
+    self._sorted_keys = sorted(self._names)
+
+  def __len__(self):
+      return len(self._names)
+
+  def __iter__(self):
+      return iter(self._names.values())
+
+  def add(self, product_name):
+      key = self._insert(product_name)
+      if key is not None:
+        bisect.insort(self._sorted_keys, key)
+
+  def _insert(self, product_name):
+      key = product_name.lower()
+      if key in self._names:
+        return None
+      self._names[key] = product_name
+      trigrams = _trigrams_of(key)
+      self._trigram_counts[key] = len(trigrams)
+      for trigram in trigrams:
+        self._trigrams.setdefault(trigram, set()).add(key)
+      return key
+
+  def remove(self, product_name):
+      key = product_name.lower()
+      if self._names.pop(key, None) is None:
+        return
+      del self._trigram_counts[key]
+      del self._sorted_keys[bisect.bisect_left(self._sorted_keys, key)]
+      for trigram in _trigrams_of(key):
+        keys = self._trigrams[trigram]
+        keys.discard(key)
+        if not keys:
+          del self._trigrams[trigram]
+
+  def starting_with(self, prefix, limit=10):
+      prefix = prefix.lower()
+      position = bisect.bisect_left(self._sorted_keys, prefix)
+      names = []
+      while position < len(self._sorted_keys) and len(names) < limit:
+        key = self._sorted_keys[position]
+        if not key.startswith(prefix):
+          break
+        names.append(self._names[key])
+        position += 1
+      return names
+
+  def closest(self, name, limit=5, min_similarity=0.3):
+      name_key = name.lower()
+      trigrams = _trigrams_of(name_key)
+      postings = sorted((self._trigrams[trigram] for trigram in trigrams if trigram in self._trigrams), key=len)
+      candidates = set()
+      for keys in postings:
+        if len(candidates) + len(keys) > self.MAX_CANDIDATES:
+          break
+        candidates.update(keys)
+      if not candidates and postings:
+        candidates = set(islice(postings[0], self.MAX_SCANNED))
+        for keys in postings[1:]:
+          if len(candidates) <= self.MAX_CANDIDATES:
+            break
+          candidates = candidates & keys or candidates
+        candidates = set(islice(candidates, self.MAX_CANDIDATES))
+
+      candidates.update(name_key[:end] for end in range(len(name_key), 0, -1) if name_key[:end] in self._names)
+      candidates.update(product_name.lower() for product_name in self.starting_with(name_key, limit))
+      common = Counter()
+      for keys in postings:
+        common.update(candidates & keys)
+      ranking = []
+      for key in candidates:
+        similarity = common[key] / (len(trigrams) + self._trigram_counts[key] - common[key])
+        if similarity >= min_similarity:
+          ranking.append((similarity, key))
+      return [self._names[key] for _, key in heapq.nlargest(limit, ranking)]
+
+
+def _trigrams_of(key):
+    padded = f"  {key} "
+    return {padded[position:position + 3] for position in range(len(padded) - 2)}
+
+
+"""
+    The Ledger class keeps the persistent history of sales and purchases in an SQLite database.
+    Each entry has the same shape used in the rest of the program ("product", "quantity", "price") plus a "timestamp".
+    Running totals are updated in the same transaction as each entry, so the totals never need to replay the history.
+    In the same way, each entry is added to the rollups: revenue, cost and quantities pre-aggregated by hour, day and month,
+    per product and overall, so period reports read a few buckets instead of the entries.
+
+    The ledger is also the event store of the register: every purchase, sale, price change and adjustment applied to
+    the register is recorded as an event with the same shape as the entries plus "kind" and the state of the product
+    after the change ("stock", "buy_price", "sell_price"). Every `checkpoint_interval` events a checkpoint is saved with the state
+    of the products changed since the previous checkpoint (chained checkpoints), so saving it costs at most
+    `checkpoint_interval` rows whatever the size of the catalog. The inventory at any time is rebuilt from the latest state
+    of each product in the checkpoints before that time plus at most `checkpoint_interval` events,
+    instead of replaying the whole history.
+
+    Instance attributes:
+    _filename (str): Name of the SQLite database file. Default: "warehouse_ledger.db".
+    _connection (sqlite3.Connection): Open connection to the database.
+    _checkpoint_interval (int): Number of events after which a new checkpoint is saved. Default: 10000.
+
+    Tables:
+    sales, purchases: one row per entry, indexed by (product, timestamp) and by timestamp.
+    product_totals: revenue and cost of each product, one row per product.
+    ledger_totals: single row with the overall revenue and cost.
+    rollups: one row per (granularity, bucket, product) with revenue, cost, quantity_sold and quantity_bought.
+             granularity is "hour", "day" or "month"; bucket is the local time formatted with ROLLUP_FORMATS
+             (for example "2026-10-16T14", "2026-10-16", "2026-10"); the overall rows have product "".
+    events: one row per change of a product, with kind ("purchase", "sale", "price" or "adjust"), quantity
+            (the change of the stock), price, timestamp and the state of the product after the change.
+    checkpoints, checkpoint_stock: the state after the event `event_id` of each checkpoint of the products changed since
+                                   the previous checkpoint, indexed by (product, checkpoint_id). The first checkpoint
+                                   has every product.
+
+    Methods:
+    __init__(self, filename="warehouse_ledger.db", checkpoint_interval=10000):
+    Constructor of the class. Opens the database and creates tables and indexes if they do not exist.
+
+    record_sale(product, quantity, price, timestamp=None) / record_purchase(product, quantity, price, timestamp=None):
+    Record a single entry. If timestamp is None, the current time is used.
+
+    record_sales(entries) / record_purchases(entries):
+    Record a list of entries in a single transaction.
+
+    begin_group() / commit_group():
+    Between the two calls, entries are kept in memory and `commit_group` writes all of them in a single transaction.
+
+    discard_group():
+    Drops the entries kept in memory since `begin_group` without writing them.
+
+    gross_profit(), total_costs(), net_profit(), has_sales():
+    Return the overall figures from the running totals, in constant time.
+
+    product_totals(product):
+    Returns revenue, cost and net profit of a single product with an index lookup.
+
+    totals_between(start, end, product=None):
+    Returns revenue, cost and net profit of the entries with start <= timestamp < end. The range is split into whole
+    months, days and hours, read from the rollups, plus the partial hours at both ends, read from the entries
+    with the timestamp indexes; so the cost depends on the length of the range, not on the number of entries.
+
+    sales() / purchases():
+    Generators returning the recorded entries in insertion order.
+
+    rollup(granularity, start=None, end=None, product=None, by_product=False):
+    Returns the buckets of `granularity` between the bucket names `start` and `end` (both included, None for no limit),
+    in order, as dictionaries with bucket, product, revenue, cost, net_profit, quantity_sold and quantity_bought.
+    By default the overall buckets are returned; with `product` only the buckets of that product,
+    with by_product=True the buckets of every product.
+
+    rebuild_rollups():
+    Computes the rollups again from all the entries. It is called automatically the first time a ledger
+    created by a version without rollups is opened.
+
+    record_events(events):
+    Records a list of events (dictionaries with kind, product, quantity, price, stock, buy_price and sell_price),
+    saving a new checkpoint when `checkpoint_interval` events were recorded since the previous one.
+    Inside a group the events are written by `commit_group` together with the entries.
+
+    has_checkpoints() / write_checkpoint(stock):
+    `write_checkpoint` saves `stock` ({product: {"quantity", "buy_price", "sell_price"}}) as the state after the
+    last recorded event. Register uses it once, to save the state of the products registered before the event store.
+
+    inventory_at(timestamp, product=None):
+    Returns the inventory at `timestamp` as {product: {"quantity", "buy_price", "sell_price"}}, or only the dictionary
+    of `product` (None if the product did not exist). Returns None if `timestamp` is before the first checkpoint.
+
+    history(product, start=None, end=None):
+    Returns the events of `product` with start <= timestamp < end, in order, to audit how its stock changed.
+
+    daily_sales(after_day=None, until_day=None):
+    Returns the (day, product, quantity sold) rows of the daily rollups with after_day < day <= until_day, in order of day.
+
+    load_velocities() / save_velocities(span_days, folded_day, velocities):
+    Read and update the state of ReorderEngine: the last day folded into the velocities, the span they were computed
+    with, and {product: (velocity, last day with sales)}. `save_velocities` only writes the given products.
+"""
+
+ROLLUP_FORMATS = {"hour": "%Y-%m-%dT%H", "day": "%Y-%m-%d", "month": "%Y-%m"}
+
+class Ledger:
+  def __init__(self, filename="warehouse_ledger.db", checkpoint_interval=10000):
+    self._filename = filename
+    self._checkpoint_interval = checkpoint_interval
+    self._group = None
+    self._connection = sqlite3.connect(filename)
+    self._connection.execute("PRAGMA journal_mode=WAL")
+    self._connection.execute("PRAGMA synchronous=NORMAL")
+    with self._connection:
+      self._connection.executescript("""
+        CREATE TABLE IF NOT EXISTS sales (
+          id INTEGER PRIMARY KEY, product TEXT NOT NULL, quantity INTEGER NOT NULL, price REAL NOT NULL, timestamp REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS sales_product ON sales (product, timestamp);
+        CREATE INDEX IF NOT EXISTS sales_timestamp ON sales (timestamp);
+
+        CREATE TABLE IF NOT EXISTS purchases (
+          id INTEGER PRIMARY KEY, product TEXT NOT NULL, quantity INTEGER NOT NULL, price REAL NOT NULL, timestamp REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS purchases_product ON purchases (product, timestamp);
+        CREATE INDEX IF NOT EXISTS purchases_timestamp ON purchases (timestamp);
+
+        CREATE TABLE IF NOT EXISTS product_totals (
+          product TEXT PRIMARY KEY, revenue REAL NOT NULL DEFAULT 0, cost REAL NOT NULL DEFAULT 0);
+
+        CREATE TABLE IF NOT EXISTS ledger_totals (
+          id INTEGER PRIMARY KEY CHECK (id = 1), revenue REAL NOT NULL DEFAULT 0, cost REAL NOT NULL DEFAULT 0, sales INTEGER NOT NULL DEFAULT 0);
+        INSERT OR IGNORE INTO ledger_totals (id) VALUES (1);
+
+        CREATE TABLE IF NOT EXISTS rollups (
+          granularity TEXT NOT NULL, bucket TEXT NOT NULL, product TEXT NOT NULL,
+          revenue REAL NOT NULL DEFAULT 0, cost REAL NOT NULL DEFAULT 0,
+          quantity_sold INTEGER NOT NULL DEFAULT 0, quantity_bought INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY (granularity, product, bucket));
+        CREATE INDEX IF NOT EXISTS rollups_bucket ON rollups (granularity, bucket);
+
+        CREATE TABLE IF NOT EXISTS events (
+          id INTEGER PRIMARY KEY, kind TEXT NOT NULL, product TEXT NOT NULL, quantity INTEGER NOT NULL, price REAL,
+          timestamp REAL NOT NULL, stock INTEGER NOT NULL, buy_price REAL, sell_price REAL);
+        CREATE INDEX IF NOT EXISTS events_product ON events (product, id);
+        CREATE INDEX IF NOT EXISTS events_timestamp ON events (timestamp);
+
+        CREATE TABLE IF NOT EXISTS checkpoints (
+          id INTEGER PRIMARY KEY, event_id INTEGER NOT NULL, timestamp REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS checkpoints_timestamp ON checkpoints (timestamp);
+        CREATE TABLE IF NOT EXISTS checkpoint_stock (
+          checkpoint_id INTEGER NOT NULL, product TEXT NOT NULL, quantity INTEGER NOT NULL, buy_price REAL, sell_price REAL,
+          PRIMARY KEY (checkpoint_id, product));
+        CREATE INDEX IF NOT EXISTS checkpoint_stock_product ON checkpoint_stock (product, checkpoint_id);
+
+        CREATE TABLE IF NOT EXISTS velocities (
+          product TEXT PRIMARY KEY, velocity REAL NOT NULL, last_day INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS velocity_state (
+          id INTEGER PRIMARY KEY CHECK (id = 1), span_days REAL NOT NULL, folded_day TEXT);
+      """)
+
+    has_rollups = self._connection.execute("SELECT EXISTS (SELECT 1 FROM rollups)").fetchone()[0]
+    has_entries = self._connection.execute(
+      "SELECT EXISTS (SELECT 1 FROM sales) OR EXISTS (SELECT 1 FROM purchases)").fetchone()[0]
+    if has_entries and not has_rollups:
+      self.rebuild_rollups()
+
+  def get_filename(self):
+    return self._filename
+
+  """
+  _record(self, table, total_column, entries):
+  Inserts the entries in `table` and adds their amounts (quantity * price) to `total_column` of the running totals,
+  all in one transaction: either every entry and its totals are saved, or nothing is.
+  Inside a group (see `begin_group`) the rows are only prepared, and written by `commit_group`.
+  """
+
+  def _record(self, table, total_column, entries):
+      rows = []
+      amounts = {}
+      now = time.time()
+      for entry in entries:
+        timestamp = entry.get("timestamp")
+        if timestamp is None:
+          timestamp = now
+        rows.append((entry["product"], entry["quantity"], entry["price"], timestamp))
+        amounts[entry["product"]] = amounts.get(entry["product"], 0) + entry["quantity"] * entry["price"]
+
+      if not rows:
+        return
+
+      if self._group is not None:
+        self._group.append((table, total_column, rows, amounts))
+        return
+
+      with self._connection:
+        self._write(table, total_column, rows, amounts)
+
+  def _write(self, table, total_column, rows, amounts):
+      self._connection.executemany(
+        f"INSERT INTO {table} (product, quantity, price, timestamp) VALUES (?, ?, ?, ?)", rows)
+      self._connection.executemany(
+        f"""INSERT INTO product_totals (product, {total_column}) VALUES (?, ?)
+            ON CONFLICT (product) DO UPDATE SET {total_column} = {total_column} + excluded.{total_column}""",
+        amounts.items())
+      sales_count = len(rows) if table == "sales" else 0
+      self._connection.execute(
+        f"UPDATE ledger_totals SET {total_column} = {total_column} + ?, sales = sales + ? WHERE id = 1",
+        (sum(amounts.values()), sales_count))
+      self._write_rollups(table, total_column, _rollup_rows(rows))
+
+  def _write_rollups(self, table, total_column, buckets):
+      quantity_column = "quantity_sold" if table == "sales" else "quantity_bought"
+      self._connection.executemany(
+        f"""INSERT INTO rollups (granularity, bucket, product, {total_column}, {quantity_column}) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (granularity, product, bucket) DO UPDATE SET
+              {total_column} = {total_column} + excluded.{total_column},
+              {quantity_column} = {quantity_column} + excluded.{quantity_column}""",
+        [(granularity, bucket, product, amount, quantity)
+         for (granularity, bucket, product), (amount, quantity) in buckets.items()])
+
+  def rebuild_rollups(self):
+      with self._connection:
+        self._connection.execute("DELETE FROM rollups")
+        for table, total_column in (("sales", "revenue"), ("purchases", "cost")):
+          cursor = self._connection.execute(f"SELECT product, quantity, price, timestamp FROM {table}")
+          while True:
+            rows = cursor.fetchmany(100000)
+            if not rows:
+              break
+            self._write_rollups(table, total_column, _rollup_rows(rows))
+
+  def rollup(self, granularity, start=None, end=None, product=None, by_product=False):
+      if granularity not in ROLLUP_FORMATS:
+        raise ValueError(f"Unknown granularity: {granularity}. Use one of {', '.join(ROLLUP_FORMATS)}.")
+
+      conditions = ["granularity = ?"]
+      parameters = [granularity]
+      if not by_product:
+        conditions.append("product = ?")
+        parameters.append("" if product is None else product)
+      if start is not None:
+        conditions.append("bucket >= ?")
+        parameters.append(start)
+      if end is not None:
+        conditions.append("bucket <= ?")
+        parameters.append(end)
+      where = " AND ".join(conditions)
+      if by_product:
+        where += " AND product != ''"
+
+      cursor = self._connection.execute(
+        f"""SELECT bucket, product, revenue, cost, quantity_sold, quantity_bought FROM rollups
+            WHERE {where} ORDER BY bucket, product""", parameters)
+      return [{"bucket": bucket, "product": product_name or None, "revenue": revenue, "cost": cost,
+               "net_profit": revenue - cost, "quantity_sold": quantity_sold, "quantity_bought": quantity_bought}
+              for bucket, product_name, revenue, cost, quantity_sold, quantity_bought in cursor]
+
+  def begin_group(self):
+      if self._group is None:
+        self._group = []
+
+  def commit_group(self):
+      group = self._group
+      self._group = None
+      if not group:
+        return
+      with self._connection:
+        for table, total_column, rows, amounts in group:
+          if table == "events":
+            self._write_events(rows)
+          else:
+            self._write(table, total_column, rows, amounts)
+
+  def discard_group(self):
+      self._group = None
+
+  def record_sales(self, entries):
+      self._record("sales", "revenue", entries)
+
+  def record_purchases(self, entries):
+      self._record("purchases", "cost", entries)
+
+  def record_sale(self, product, quantity, price, timestamp=None):
+      self.record_sales([{"product": product, "quantity": quantity, "price": price, "timestamp": timestamp}])
+
+  def record_purchase(self, product, quantity, price, timestamp=None):
+      self.record_purchases([{"product": product, "quantity": quantity, "price": price, "timestamp": timestamp}])
+
+  def _totals(self):
+      return self._connection.execute("SELECT revenue, cost, sales FROM ledger_totals WHERE id = 1").fetchone()
+
+  def gross_profit(self):
+      return self._totals()[0]
+
+  def total_costs(self):
+      return self._totals()[1]
+
+  def net_profit(self):
+      revenue, cost, _ = self._totals()
+      return revenue - cost
+
+  def has_sales(self):
+      return self._totals()[2] > 0
+
+  def product_totals(self, product):
+      row = self._connection.execute(
+        "SELECT revenue, cost FROM product_totals WHERE product = ?", (product,)).fetchone()
+      revenue, cost = row if row else (0, 0)
+      return {"product": product, "revenue": revenue, "cost": cost, "net_profit": revenue - cost}
+
+  def totals_between(self, start, end, product=None):
+      revenue = 0
+      cost = 0
+      entry_ranges, bucket_ranges = _split_time_range(start, end)
+      for range_start, range_end in entry_ranges:
+        range_revenue, range_cost = self._entry_totals(range_start, range_end, product)
+        revenue += range_revenue
+        cost += range_cost
+      for granularity, first_bucket, last_bucket in bucket_ranges:
+        range_revenue, range_cost = self._connection.execute(
+          """SELECT COALESCE(SUM(revenue), 0), COALESCE(SUM(cost), 0) FROM rollups
+             WHERE granularity = ? AND product = ? AND bucket >= ? AND bucket <= ?""",
+          (granularity, "" if product is None else product, first_bucket, last_bucket)).fetchone()
+        revenue += range_revenue
+        cost += range_cost
+      return {"revenue": revenue, "cost": cost, "net_profit": revenue - cost}
+
+  def _entry_totals(self, start, end, product=None):
+      condition = "timestamp >= ? AND timestamp < ?"
+      parameters = (start, end)
+      if product is not None:
+        condition = "product = ? AND " + condition
+        parameters = (product, start, end)
+
+      revenue = self._connection.execute(
+        f"SELECT COALESCE(SUM(quantity * price), 0) FROM sales WHERE {condition}", parameters).fetchone()[0]
+      cost = self._connection.execute(
+        f"SELECT COALESCE(SUM(quantity * price), 0) FROM purchases WHERE {condition}", parameters).fetchone()[0]
+      return revenue, cost
+
+  def _entries(self, table):
+      cursor = self._connection.execute(f"SELECT product, quantity, price, timestamp FROM {table} ORDER BY id")
+      for product, quantity, price, timestamp in cursor:
+        yield {"product": product, "quantity": quantity, "price": price, "timestamp": timestamp}
+
+  def sales(self):
+      return self._entries("sales")
+
+  def purchases(self):
+      return self._entries("purchases")
+
+  def record_events(self, events):
+      now = time.time()
+      rows = [(event["kind"], event["product"], event["quantity"], event.get("price"), now,
+               event["stock"], event.get("buy_price"), event.get("sell_price")) for event in events]
+      if not rows:
+        return
+      if self._group is not None:
+        self._group.append(("events", None, rows, None))
+        return
+      with self._connection:
+        self._write_events(rows)
+
+  def _write_events(self, rows):
+      self._connection.executemany(
+        """INSERT INTO events (kind, product, quantity, price, timestamp, stock, buy_price, sell_price)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+      last_event_id = self._connection.execute("SELECT MAX(id) FROM events").fetchone()[0]
+      checkpoint = self._last_checkpoint()
+      checkpoint_event_id = checkpoint[1] if checkpoint else 0
+      if last_event_id - checkpoint_event_id >= self._checkpoint_interval:
+        self._insert_checkpoint(last_event_id, self._events_after(checkpoint_event_id, last_event_id))
+
+  def _last_checkpoint(self, timestamp=None):
+      if timestamp is None:
+        return self._connection.execute("SELECT id, event_id FROM checkpoints ORDER BY id DESC LIMIT 1").fetchone()
+      return self._connection.execute(
+        "SELECT id, event_id FROM checkpoints WHERE timestamp <= ? ORDER BY id DESC LIMIT 1", (timestamp,)).fetchone()
+
+  def _checkpoint_stock(self, checkpoint_id, product=None):
+      query = "SELECT product, quantity, buy_price, sell_price FROM checkpoint_stock WHERE checkpoint_id <= ?"
+      parameters = (checkpoint_id,)
+      if product is not None:
+        query += " AND product = ?"
+        parameters = (checkpoint_id, product)
+      query += " ORDER BY checkpoint_id"
+      return {product_name: {"quantity": quantity, "buy_price": buy_price, "sell_price": sell_price}
+              for product_name, quantity, buy_price, sell_price in self._connection.execute(query, parameters)}
+
+  def _events_after(self, event_id, last_event_id=None, timestamp=None, product=None):
+      conditions = ["id > ?"]
+      parameters = [event_id]
+      for condition, value in (("id <= ?", last_event_id), ("timestamp <= ?", timestamp), ("product = ?", product)):
+        if value is not None:
+          conditions.append(condition)
+          parameters.append(value)
+      cursor = self._connection.execute(
+        f"""SELECT product, stock, buy_price, sell_price FROM events
+            WHERE {" AND ".join(conditions)} ORDER BY id""", parameters)
+      return {product_name: {"quantity": stock, "buy_price": buy_price, "sell_price": sell_price}
+              for product_name, stock, buy_price, sell_price in cursor}
+
+  def _insert_checkpoint(self, event_id, stock):
+      checkpoint_id = self._connection.execute(
+        "INSERT INTO checkpoints (event_id, timestamp) VALUES (?, ?)", (event_id, time.time())).lastrowid
+      self._connection.executemany(
+        "INSERT INTO checkpoint_stock (checkpoint_id, product, quantity, buy_price, sell_price) VALUES (?, ?, ?, ?, ?)",
+        [(checkpoint_id, product_name, data["quantity"], data["buy_price"], data["sell_price"])
+         for product_name, data in stock.items()])
+
+  def has_checkpoints(self):
+      return self._last_checkpoint() is not None
+
+  def write_checkpoint(self, stock):
+      with self._connection:
+        last_event_id = self._connection.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        self._insert_checkpoint(last_event_id, stock)
+
+  def inventory_at(self, timestamp, product=None):
+      checkpoint = self._last_checkpoint(timestamp)
+      if checkpoint is None:
+        return None
+      checkpoint_id, event_id = checkpoint
+      stock = self._checkpoint_stock(checkpoint_id, product)
+      stock.update(self._events_after(event_id, timestamp=timestamp, product=product))
+      if product is not None:
+        return stock.get(product)
+      return stock
+
+  def history(self, product, start=None, end=None):
+      conditions = ["product = ?"]
+      parameters = [product]
+      if start is not None:
+        conditions.append("timestamp >= ?")
+        parameters.append(start)
+      if end is not None:
+        conditions.append("timestamp < ?")
+        parameters.append(end)
+      cursor = self._connection.execute(
+        f"""SELECT kind, quantity, price, timestamp, stock, buy_price, sell_price FROM events
+            WHERE {" AND ".join(conditions)} ORDER BY id""", parameters)
+      return [{"kind": kind, "product": product, "quantity": quantity, "price": price, "timestamp": timestamp,
+               "stock": stock, "buy_price": buy_price, "sell_price": sell_price}
+              for kind, quantity, price, timestamp, stock, buy_price, sell_price in cursor]
+
+  def daily_sales(self, after_day=None, until_day=None):
+      conditions = ["granularity = 'day'", "product != ''", "quantity_sold > 0"]
+      parameters = []
+      if after_day is not None:
+        conditions.append("bucket > ?")
+        parameters.append(after_day)
+      if until_day is not None:
+        conditions.append("bucket <= ?")
+        parameters.append(until_day)
+      return self._connection.execute(
+        f"""SELECT bucket, product, quantity_sold FROM rollups
+            WHERE {" AND ".join(conditions)} ORDER BY bucket""", parameters).fetchall()
+
+  def load_velocities(self):
+      state = self._connection.execute("SELECT span_days, folded_day FROM velocity_state WHERE id = 1").fetchone()
+      span_days, folded_day = state if state else (None, None)
+      velocities = {product: (velocity, last_day)
+                    for product, velocity, last_day in self._connection.execute("SELECT product, velocity, last_day FROM velocities")}
+      return span_days, folded_day, velocities
+
+  def save_velocities(self, span_days, folded_day, velocities):
+      with self._connection:
+        if span_days is None:
+          self._connection.execute("DELETE FROM velocities")
+          self._connection.execute("DELETE FROM velocity_state")
+          return
+        self._connection.execute(
+          "INSERT OR REPLACE INTO velocity_state (id, span_days, folded_day) VALUES (1, ?, ?)", (span_days, folded_day))
+        self._connection.executemany(
+          "INSERT OR REPLACE INTO velocities (product, velocity, last_day) VALUES (?, ?, ?)",
+          [(product, velocity, last_day) for product, (velocity, last_day) in velocities.items()])
+
+  def close(self):
+      self._connection.close()
+
+
+"""
+Helper function of Ledger.totals_between that splits the time range start <= timestamp < end into
+the parts read from the entries (the partial hours at both ends) and the parts read from the rollups
+(whole hours, days and months, in local time like the rollup buckets)
+
+The boundaries of the buckets are computed with `_local_boundary`, so they are right also on the days
+when daylight saving time starts or ends: when the clocks go back, the repeated hour is a single bucket
+two hours long (for example "2025-10-26T02" in Europe/Rome), which is read from the rollups only if the range
+covers both hours, otherwise from the entries.
+
+Returns:
+tuple: (list of (start, end) ranges of entries, list of (granularity, first bucket, last bucket) ranges of rollups)
+"""
+def _split_time_range(start, end):
+    def boundary(timestamp, granularity, next_one):
+        local_time = time.localtime(timestamp)
+        fields = [local_time.tm_year, local_time.tm_mon, local_time.tm_mday, local_time.tm_hour]
+        keep = {"month": 2, "day": 3, "hour": 4}[granularity]
+        fields = fields[:keep] + [1, 0][keep - 2:]
+        floor = _local_boundary(fields)
+        if next_one and floor < timestamp:
+          fields[keep - 1] += 1
+          if fields[1] > 12:
+            fields[0:2] = [fields[0] + 1, 1]
+          return _local_boundary(fields)
+        return floor
+
+    entry_ranges = []
+    bucket_ranges = []
+    inner_start, inner_end = start, end
+    for granularity, finer_granularity in (("hour", None), ("day", "hour"), ("month", "day")):
+      outer_start, outer_end = inner_start, inner_end
+      inner_start = boundary(outer_start, granularity, True)
+      inner_end = boundary(outer_end, granularity, False)
+      if inner_start >= inner_end:
+        inner_start = inner_end = outer_end
+      for range_start, range_end in ((outer_start, inner_start), (inner_end, outer_end)):
+        if range_start >= range_end:
+          continue
+        if finer_granularity is None:
+          entry_ranges.append((range_start, range_end))
+        else:
+          bucket_ranges.append(_bucket_range(finer_granularity, range_start, range_end))
+      if inner_start >= inner_end:
+        return entry_ranges, bucket_ranges
+    bucket_ranges.append(_bucket_range("month", inner_start, inner_end))
+    return entry_ranges, bucket_ranges
+
+
+"""
+Helper function of _split_time_range that returns the first instant at which the local clock shows
+the time `fields` ([year, month, day, hour]) or a later one
+
+time.mktime is tried both as standard and as daylight saving time: when the clocks go back the time is shown twice
+and the first instant is taken, when they go forward and the time is skipped, the instant of the change is taken.
+"""
+def _local_boundary(fields):
+    local_seconds = calendar.timegm((*fields, 0, 0))
+    candidates = [time.mktime((*fields, 0, 0, 0, 0, is_dst)) for is_dst in (0, 1)]
+    return min((candidate for candidate in candidates if candidate + time.localtime(candidate).tm_gmtoff >= local_seconds),
+               default=max(candidates))
+
+
+def _bucket_range(granularity, start, end):
+    bucket_format = ROLLUP_FORMATS[granularity]
+    return granularity, time.strftime(bucket_format, time.localtime(start)), time.strftime(bucket_format, time.localtime(end - 1))
+
+"""
+Helper function of Ledger that adds up a list of (product, quantity, price, timestamp) rows into rollup buckets
+
+Returns:
+dict: (granularity, bucket, product) -> [amount, quantity], with product "" for the overall buckets
+"""
+def _rollup_rows(rows):
+    buckets = {}
+    for product, quantity, price, timestamp in rows:
+      local_time = time.localtime(timestamp)
+      for granularity, bucket_format in ROLLUP_FORMATS.items():
+        bucket = time.strftime(bucket_format, local_time)
+        for key in ((granularity, bucket, product), (granularity, bucket, "")):
+          totals = buckets.get(key)
+          if totals is None:
+            buckets[key] = [quantity * price, quantity]
+          else:
+            totals[0] += quantity * price
+            totals[1] += quantity
+    return buckets
+
+
+"""
+    The RegisterMetrics class collects the optional measures of a Register (see the `metrics` parameter of Register).
+
+    For every measured operation it keeps the number of calls, the total time and a histogram of the durations;
+    it also counts the bytes written by the persistence methods and the snapshots written or skipped.
+    With profile=True it also runs cProfile and tracemalloc from its creation, to find which functions
+    use the time and which lines allocate the memory.
+
+    Instance attributes:
+    _counters (dict): operation -> number of calls.
+    _total_seconds (dict): operation -> total time of the calls.
+    _histograms (dict): operation -> list of call counts, one per bucket of HISTOGRAM_BOUNDS_MS.
+    _bytes (dict): "snapshot" / "journal" -> bytes written.
+    _events (dict): other counters, for example "snapshot_writes" and "snapshot_skips".
+    _profiler (cProfile.Profile): The profiler, None if profile is False.
+
+    Methods:
+    observe(operation, seconds): records one call of an operation.
+    add_bytes(kind, count) / count_event(event): update the byte and event counters.
+    dump(self): returns all the measures as a dictionary, ready for json.dump.
+    report(self): returns the measures as readable text, with the profile when enabled.
+"""
+
+class RegisterMetrics:
+
+  HISTOGRAM_BOUNDS_MS = (0.01, 0.1, 1, 10, 100, 1000)
+
+  def __init__(self, profile=False):
+    self._counters = {}
+    self._total_seconds = {}
+    self._histograms = {}
+    self._bytes = {}
+    self._events = {}
+    self._profiler = None
+    if profile:
+      self._profiler = cProfile.Profile()
+      self._profiler.enable()
+      tracemalloc.start()
+
+  def observe(self, operation, seconds):
+      self._counters[operation] = self._counters.get(operation, 0) + 1
+      self._total_seconds[operation] = self._total_seconds.get(operation, 0) + seconds
+      histogram = self._histograms.get(operation)
+      if histogram is None:
+        histogram = self._histograms[operation] = [0] * (len(self.HISTOGRAM_BOUNDS_MS) + 1)
+      histogram[bisect.bisect_left(self.HISTOGRAM_BOUNDS_MS, seconds * 1000)] += 1
+
+  def add_bytes(self, kind, count):
+      self._bytes[kind] = self._bytes.get(kind, 0) + count
+
+  def count_event(self, event):
+      self._events[event] = self._events.get(event, 0) + 1
+
+  def dump(self):
+      operations = {}
+      for operation, count in self._counters.items():
+        operations[operation] = {
+            "count": count,
+            "total_ms": self._total_seconds[operation] * 1000,
+            "mean_ms": self._total_seconds[operation] * 1000 / count,
+            "histogram_ms": {f"<={bound}": calls for bound, calls in zip(self.HISTOGRAM_BOUNDS_MS, self._histograms[operation])},
+        }
+        operations[operation]["histogram_ms"][f">{self.HISTOGRAM_BOUNDS_MS[-1]}"] = self._histograms[operation][-1]
+
+      metrics = {"operations": operations, "bytes_written": dict(self._bytes), "events": dict(self._events)}
+      if self._profiler is not None and tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        metrics["memory"] = {"current_bytes": current, "peak_bytes": peak}
+      return metrics
+
+  def report(self):
+      metrics = self.dump()
+      lines = ["OPERATION CALLS TOTAL(ms) MEAN(ms)"]
+      for operation, data in sorted(metrics["operations"].items()):
+        lines.append(f"{operation} {data['count']} {data['total_ms']:.3f} {data['mean_ms']:.3f}")
+      for kind, count in sorted(metrics["bytes_written"].items()):
+        lines.append(f"Bytes written to {kind}: {count}")
+      for event, count in sorted(metrics["events"].items()):
+        lines.append(f"{event}: {count}")
+
+      if self._profiler is not None:
+        self._profiler.disable()
+        profile_output = io.StringIO()
+        pstats.Stats(self._profiler, stream=profile_output).sort_stats("cumulative").print_stats(15)
+        self._profiler.enable()
+        lines.append(profile_output.getvalue())
+        if tracemalloc.is_tracing():
+          lines.append(f"Memory: current {metrics['memory']['current_bytes']} bytes, peak {metrics['memory']['peak_bytes']} bytes")
+          for statistic in tracemalloc.take_snapshot().statistics("lineno")[:5]:
+            lines.append(str(statistic))
+      return "\n".join(lines)
+
+
+"""
+Decorator used on the Register methods measured by RegisterMetrics
+When the register has no metrics, the method is called directly, so the only cost is one attribute check.
+
+Parameters:
+operation (str): Name of the operation in the metrics
+"""
+def _timed(operation):
+    def decorator(method):
+      @functools.wraps(method)
+      def wrapper(self, *args, **kwargs):
+          metrics = self._metrics
+          if metrics is None:
+            return method(self, *args, **kwargs)
+          start = time.perf_counter()
+          try:
+            return method(self, *args, **kwargs)
+          finally:
+            metrics.observe(operation, time.perf_counter() - start)
+      return wrapper
+    return decorator
+
+
+"""
+Helper function that returns the ledger file name used by default for the register file `filename`
+"""
+def _default_ledger_filename(filename):
+    directory, basename = os.path.split(filename)
+    if basename == "warehouse_register.json":
+      return os.path.join(directory, "warehouse_ledger.db")
+    return os.path.splitext(filename)[0] + "_ledger.db"
+
+
+"""
+Helper function of the batch methods of Register: the results of a rejected atomic batch,
+where the valid lines are reported as RESULT_NOT_APPLIED instead of RESULT_OK
+"""
+def _not_applied(results):
+    return [(product_name, RESULT_NOT_APPLIED if result == RESULT_OK else result) for product_name, result in results]
+
+
+"""
+Helper function to replace a file without ever leaving it half written
+The content is written by `write_content` to a temporary file, which is flushed to disk with fsync
+and then renamed over `filename`; on POSIX systems the directory is also synced so that the rename is durable.
+
+Parameters:
+filename (str): The file to replace
+write_content (function): Called with the open temporary file to write the new content
+mode (str): Mode used to open the temporary file, "w" for text or "wb" for binary content
+"""
+def _replace_file_atomically(filename, write_content, mode="w"):
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, mode) as temp_file:
+      write_content(temp_file)
+      temp_file.flush()
+      os.fsync(temp_file.fileno())
+    os.replace(temp_filename, filename)
+
+    if fcntl is not None:
+      directory = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+      try:
+        os.fsync(directory)
+      finally:
+        os.close(directory)
+
+"""
+Helper functions to take and release an exclusive lock on an open file,
+with fcntl on Linux and macOS and with msvcrt on Windows (where the first byte of the file is locked)
+"""
+def _lock_file(lock_file):
+    if fcntl is not None:
+      fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+      return
+    lock_file.seek(0)
+    while True:
+      try:
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        return
+      except OSError:
+        continue
+
+
+def _unlock_file(lock_file):
+    if fcntl is not None:
+      fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+      return
+    lock_file.seek(0)
+    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+"""
+Rendering of the listings and receipts printed by Register
+LISTING_PAGE_SIZE: products shown on each page of a paginated listing
+RENDER_CHUNK_LINES: lines joined into a single write to the terminal
+"""
+LISTING_PAGE_SIZE = 50
+RENDER_CHUNK_LINES = 1000
+
+
+def _print_chunks(lines):
+    for start in range(0, len(lines), RENDER_CHUNK_LINES):
+      print("".join(lines[start:start + RENDER_CHUNK_LINES]), end="")
+
+
+"""
+Formats a line of a receipt; the same product sold with the same quantity and price is formatted only once
+"""
+@functools.lru_cache(maxsize=4096)
+def _receipt_line(product_name, quantity, unit_price):
+    return (f"Product: {product_name}, Quantity: {quantity}, Unit price: {unit_price}, "
+            f"Total price: {quantity * unit_price}\n\n")
+
+
 """
     The Register class manages the inventory operations register.
     It provides functionality to save and load data to/from a JSON file.
@@ -60,75 +1393,492 @@ class Product:
     _warehouse_reg (dict): Dictionary representing the warehouse register, containing products and related information.
       If not specified, it is initialized as an empty dictionary.
     _filename (str): Name of the JSON file where the warehouse register is saved. Default: "warehouse_register.json".
-    _profits (list): List of sales transactions for profit calculation. Initialized as an empty list.
-    _costs (list): List of purchase transactions for cost calculation. Initialized as an empty list.
+    _ledger (Ledger): Persistent ledger of sales (for profit calculation) and purchases (for cost calculation).
+    _journaled (bool): True if mutations are appended to the journal instead of rewriting the whole JSON file.
+    _journal_filename (str): Name of the append-only journal file, equal to the JSON file name followed by ".log".
+    _journal_max_bytes (int): Size of the journal after which the JSON snapshot is rebuilt and the journal is emptied.
+    _compact (bool): True if the warehouse register is kept in an InventoryStore instead of a dictionary.
+    _lazy (bool): True if the products are read from the JSON snapshot only when they are used (LazyStore).
+    _index_filename (str): Name of the index of the snapshot used in lazy mode, equal to the JSON file name followed by ".idx".
+    _shared (bool): True if several processes (tills) use the same files at the same time.
+    _lock_filename (str): Name of the lock file used in shared mode, equal to the JSON file name followed by ".lock".
+    _journal_offset (int): Number of bytes of the journal already applied to the register in memory.
+    _snapshot_stamp (tuple): Identity of the JSON snapshot loaded in memory, used to notice snapshots rebuilt by other processes.
+    _loaded (bool): True once the register has been loaded from its files by `open_warehouse_reg_json`.
+    _pending_changes (dict): Products changed inside a `group_commit` block and not yet persisted, None outside the block.
+    _dirty (bool): True if the register in memory has changes that are not in the JSON snapshot yet.
+    _metrics (RegisterMetrics): Measures of the operations and of the persistence, None when disabled.
+    _name_index (ProductIndex): Index of the product names, built by `start_name_index` or the first time it is needed, None before.
+    _index_builder (threading.Thread): Thread building the index started by `start_name_index`, None when no build is running.
+    _unindexed_names (dict): Products changed while the index is being built, added to it when the build ends.
+    _index_stale (bool): True if the register was loaded again while the index was being built,
+      so the index is compared with the register when the build ends.
+    _listing_lines (list): Formatted line of each product for `print_warehouse`, in the order of the register,
+      built the first time it is needed, None before.
+    _listing_positions (dict): product name -> position of its line in _listing_lines.
+    _stale_lines (dict): Products changed since their line was formatted, formatted again at the next listing.
 
     Methods:
-    __init__(self, warehouse_reg=None, filename="warehouse_register.json"):
+    __init__(self, warehouse_reg=None, filename="warehouse_register.json", journaled=False, journal_max_bytes=1048576,
+             ledger_filename=None, compact=False, shared=False, metrics=None, lazy=False):
     Constructor of the class. Initializes the register and loads data from the JSON file if available.
 
     Parameters:
       - warehouse_reg (dict, optional): Initial product register. If None, it is initialized as an empty dictionary.
       - filename (str, optional): Name of the JSON file for saving/loading the register. Default: "warehouse_register.json".
+      - journaled (bool, optional): Enables the journaled storage mode. Default: False.
+      - journal_max_bytes (int, optional): Journal size threshold that triggers a new snapshot. Default: 1 MB.
+      - ledger_filename (str, optional): Name of the SQLite file of the ledger. Default: None, which uses
+        "warehouse_ledger.db" next to the default register file, and the register file name with "_ledger.db"
+        in place of its extension otherwise (for example "shop_ledger.db" for "shop.json"),
+        so registers saved in different files never share a ledger.
+      - compact (bool, optional): Keeps the warehouse register in an InventoryStore, for very large catalogs. Default: False.
+      - shared (bool, optional): Enables the shared mode, for several tills working on the same register. Default: False.
+        Every operation takes an exclusive lock on the lock file, applies the changes written by the other processes,
+        changes the register and appends the changed products to the journal before releasing the lock.
+        The shared mode always uses the journal, and each change increments the 'version' of the changed products.
+      - metrics (RegisterMetrics, optional): Collects timings and persistence counters of the register. Default: None (disabled).
+      - lazy (bool, optional): Keeps the warehouse register in a LazyStore, so the startup reads only the index of the
+        snapshot and each product is read when it is first used. Default: False.
+        The lazy mode always uses the journal; the whole catalog is read only by `print_warehouse`, `columns`
+        and `iter_products`. It cannot be combined with the compact mode.
 
     open_warehouse_reg_json():
     Method called in the constructor to load the register from the JSON file, if it exists.
+
+    Every change is also recorded as an event in the ledger with `record_events` (see Ledger). The first time
+    a ledger without checkpoints is used, the constructor saves the current register as the first checkpoint,
+    so the products registered before the event store also have a known state.
 """
 
 class Register:
-  def __init__(self, warehouse_reg=None, filename="warehouse_register.json"):
+  def __init__(self, warehouse_reg=None, filename="warehouse_register.json", journaled=False, journal_max_bytes=1024 * 1024,
+               ledger_filename=None, compact=False, shared=False, metrics=None, lazy=False):
+    if compact and lazy:
+      raise ValueError("The compact and lazy modes cannot be combined.")
     if warehouse_reg is None:
       warehouse_reg = {}
     self._warehouse_reg = warehouse_reg
     self._filename = filename
-    self.open_warehouse_reg_json()
-    self._profits=[]
-    self._costs=[]
+    self._journaled = journaled or shared or lazy
+    self._journal_filename = filename + ".log"
+    self._journal_max_bytes = journal_max_bytes
+    self._compact = compact
+    self._lazy = lazy
+    self._index_filename = filename + ".idx"
+    self._shared = shared
+    self._lock_filename = filename + ".lock"
+    self._lock_file = None
+    self._lock_depth = 0
+    self._journal_offset = 0
+    self._snapshot_stamp = None
+    self._loaded = False
+    self._pending_changes = None
+    self._dirty = False
+    self._metrics = metrics
+    self._name_index = None
+    self._index_builder = None
+    self._unindexed_names = {}
+    self._index_stale = False
+    self._listing_lines = None
+    self._listing_positions = {}
+    self._stale_lines = {}
+    with self.locked():
+      if not self._loaded:
+        self.open_warehouse_reg_json()
+    if ledger_filename is None:
+      ledger_filename = _default_ledger_filename(filename)
+    self._ledger = Ledger(ledger_filename)
+    if not self._ledger.has_checkpoints():
+      self.materialize()
+      self._ledger.write_checkpoint({product_name: {"quantity": data.get('quantity', 0), "buy_price": data.get('buy_price'),
+                                                    "sell_price": data.get('sell_price')}
+                                     for product_name, data in self._warehouse_reg.items()})
 
   """
-  Reading private class attributes with get method:
-  get_warehouse_reg(self): returns the warehouse register.
+  Reading private class attributes with get methods:
+  get_warehouse_reg(self): returns the warehouse register (a dictionary, or an InventoryStore that can be used in the same way).
+  get_ledger(self): returns the ledger of sales and purchases.
+  get_metrics(self): returns the RegisterMetrics of the register, or None if the metrics are disabled.
+  get_name_index(self): returns the ProductIndex of the product names. If `start_name_index` was called,
+  it waits for the end of the build (usually already over), otherwise the index is built at the first call.
+  The index is then kept up to date by `record_changes` and `replay_journal` for every new product,
+  and compared with the register when the register is loaded again (`open_warehouse_reg_json`).
+
+  start_name_index(self): starts building the index of the product names in a background thread,
+  so the first search or unknown name in a sale does not wait for the whole catalog to be indexed.
+  The names are copied before the thread starts; the products changed during the build are added when it ends.
   """
 
   def get_warehouse_reg(self):
     return self._warehouse_reg
 
+  def get_ledger(self):
+    return self._ledger
+
+  def get_metrics(self):
+    return self._metrics
+
+  def get_name_index(self):
+    if self._index_builder is not None:
+      self._index_builder.join()
+      self._index_builder = None
+      for product_name in self._unindexed_names:
+        self._name_index.add(product_name)
+      self._unindexed_names = {}
+      if self._index_stale:
+        self._index_stale = False
+        self._sync_name_index()
+    if self._name_index is None:
+      self._name_index = ProductIndex(self._warehouse_reg)
+    return self._name_index
+
+  def start_name_index(self):
+    if self._name_index is not None or self._index_builder is not None:
+      return
+    product_names = list(self._warehouse_reg)
+    self._index_builder = threading.Thread(target=self._build_name_index, args=(product_names,), daemon=True)
+    self._index_builder.start()
+
+  def _build_name_index(self, product_names):
+    self._name_index = ProductIndex(product_names)
+
+  def _index_names(self, product_names):
+    if self._index_builder is not None:
+      self._unindexed_names.update(dict.fromkeys(product_names))
+    elif self._name_index is not None:
+      for product_name in product_names:
+        self._name_index.add(product_name)
+
+  def _sync_name_index(self):
+    for product_name in [product_name for product_name in self._name_index if product_name not in self._warehouse_reg]:
+      self._name_index.remove(product_name)
+    for product_name in self._warehouse_reg:
+      self._name_index.add(product_name)
+
   """
   def open_warehouse_reg_json(self):
   Method called in the constructor to load the register from the JSON file, if it exists.
   If the warehouse register exists, the file is loaded
   If the warehouse register does not exist, an empty dictionary is created and initialized.
   If the program reports an exception in case the JSON file is corrupted or unreadable, the exception is handled.
-  In that case, an empty dictionary will be created and initialized.
+  In that case, the damaged file is kept with the ".corrupt" extension and an empty dictionary will be created and initialized.
+  In compact mode, the products are read one at a time with `_read_json_records` directly into an InventoryStore
+  (the register is always JSON, whatever the extension of its name), so the whole file is never held in memory as text or as dictionaries.
+  In lazy mode, only the index of the snapshot is read into a LazyStore. If the index is missing or out of date
+  (for example a snapshot written before the lazy mode was used), the file is loaded as usual and the register
+  is marked as changed, so the next snapshot is written together with its index.
+  In journaled mode, the records of the journal written after the last snapshot are then replayed on top of it.
+  An index of the product names already built is compared with the loaded register (names removed, for example
+  by a failed `group_commit`, and names added), instead of being built again at the next search.
 
   """
 
+  @_timed("open_warehouse_reg_json")
   def open_warehouse_reg_json(self):
+    if isinstance(self._warehouse_reg, LazyStore):
+      self._warehouse_reg.close()
     try:
-      if os.path.exists(self._filename):
+      lazy_store = LazyStore() if self._lazy else None
+      if os.path.exists(self._filename) and lazy_store is not None and lazy_store.attach(
+          self._filename, self._index_filename, self._stat_snapshot()):
+        self._warehouse_reg = lazy_store
+        print("\nThe warehouse contains already registered products\n")
+      elif os.path.exists(self._filename) and self._compact:
+        self._warehouse_reg = InventoryStore()
+        for record in _read_json_records(self._filename):
+          self._warehouse_reg[record.pop("product")] = record
+        print("\nThe warehouse contains already registered products\n")
+      elif os.path.exists(self._filename):
         with open(self._filename, "r") as json_file:
           self._warehouse_reg = json.load(json_file)
         print("\nThe warehouse contains already registered products\n")
       else:
         self._warehouse_reg = {}
-        with open(self._filename, "w") as json_file:
-            json.dump(self._warehouse_reg, json_file, indent=4)
-            print("\nThe list of products in the warehouse is empty!\n")
+        self._dirty = True
+        self.save_product_json()
+        print("\nThe list of products in the warehouse is empty!\n")
 
     except json.JSONDecodeError:
-      print("\nCannot open file, a new one will be created.\n")
+      os.replace(self._filename, self._filename + ".corrupt")
+      print(f"\nCannot open file, a new one will be created. The damaged file has been kept as {self._filename}.corrupt\n")
       self._warehouse_reg = {}
-      with open(self._filename, "w") as json_file:
-        json.dump(self._warehouse_reg, json_file, indent=4)
+      self._dirty = True
+      self.save_product_json()
+
+    self._dirty = False
+    self._listing_lines = None
+    if self._compact and not isinstance(self._warehouse_reg, InventoryStore):
+      self._warehouse_reg = InventoryStore(self._warehouse_reg)
+    if self._lazy and not isinstance(self._warehouse_reg, LazyStore):
+      self._warehouse_reg = LazyStore(self._warehouse_reg)
+      self._dirty = True
+
+    if self._index_builder is not None:
+      self._index_stale = True
+    elif self._name_index is not None:
+      self._sync_name_index()
+
+    self._loaded = True
+    self._snapshot_stamp = self._stat_snapshot()
+    self._journal_offset = 0
+    if self._journaled:
+      self.replay_journal()
+
+  """
+  def replay_journal(self):
+  Applies the records of the journal to the warehouse register, in the order in which they were written.
+  Each record is a single JSON line containing the product name and its complete data, so replaying a record twice gives the same result.
+  If the last record was torn by a crash during the write (invalid JSON or missing final newline), it is discarded
+  and the journal is truncated after the last complete record, keeping all the previous ones.
+  A damaged record followed by other records is not a torn write: the records after it are not applied,
+  the whole journal is kept with the ".corrupt" extension, and then it is truncated before the damaged record.
+  Only the part of the journal after `_journal_offset` is read, so it can also be used to apply the records
+  appended by other processes since the last replay.
+  """
+
+  @_timed("replay_journal")
+  def replay_journal(self):
+      if not os.path.exists(self._journal_filename):
+        return
+
+      start_offset = self._journal_offset
+      valid_bytes = start_offset
+      for record, valid_bytes in _read_journal_records(self._journal_filename, start_offset):
+          product_name = record.pop("product")
+          self._warehouse_reg[product_name] = record
+          if self._name_index is not None or self._index_builder is not None:
+            self._index_names((product_name,))
+          if self._listing_lines is not None:
+            self._stale_lines[product_name] = True
+
+      if valid_bytes < os.path.getsize(self._journal_filename):
+        with open(self._journal_filename, "rb") as journal_file:
+          journal_file.seek(valid_bytes)
+          torn_tail = b"\n" not in journal_file.read().rstrip(b"\n")
+        if torn_tail:
+          print("\nThe last record of the journal is incomplete and has been discarded.\n")
+        else:
+          shutil.copyfile(self._journal_filename, self._journal_filename + ".corrupt")
+          print(f"\nA record of the journal is damaged: it and the records after it have not been applied. "
+                f"The whole journal has been kept as {self._journal_filename}.corrupt\n")
+        with open(self._journal_filename, "r+b") as journal_file:
+          journal_file.truncate(valid_bytes)
+      self._journal_offset = valid_bytes
+      if valid_bytes > start_offset:
+        self._dirty = True
+
+  """
+  def locked(self):
+  Context manager used around every operation that changes the register.
+  In shared mode it takes an exclusive lock on `_lock_filename` (blocking until the other tills release it)
+  and calls `refresh` to apply the changes of the other processes, so checks and changes made inside the block
+  are atomic with respect to the other tills. The lock is reentrant within the same Register.
+  Without shared mode it does nothing.
+
+  def refresh(self):
+  Brings the register in memory up to date with the files: if another process rebuilt the JSON snapshot,
+  the register is loaded again, otherwise only the new records of the journal are replayed.
+  The constructor loads the register inside `locked`, so in shared mode the first load (and the creation
+  of the empty snapshot) happens under the lock, and never reads a journal record that another till is still writing.
+  """
+
+  @contextmanager
+  def locked(self):
+      if not self._shared:
+        yield
+        return
+
+      if self._lock_depth == 0:
+        self._lock_file = open(self._lock_filename, "a+")
+        _lock_file(self._lock_file)
+        try:
+          self.refresh()
+        except BaseException:
+          _unlock_file(self._lock_file)
+          self._lock_file.close()
+          raise
+      self._lock_depth += 1
+      try:
+        yield
+      finally:
+        self._lock_depth -= 1
+        if self._lock_depth == 0:
+          _unlock_file(self._lock_file)
+          self._lock_file.close()
+          self._lock_file = None
+
+  def refresh(self):
+      journal_size = os.path.getsize(self._journal_filename) if os.path.exists(self._journal_filename) else 0
+      if not self._loaded or self._stat_snapshot() != self._snapshot_stamp or journal_size < self._journal_offset:
+        self.open_warehouse_reg_json()
+      elif journal_size > self._journal_offset:
+        self.replay_journal()
+
+  def _stat_snapshot(self):
+      try:
+        stat = os.stat(self._filename)
+      except FileNotFoundError:
+        return None
+      return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+  """
+  get_version(self, product_name):
+  Returns the version of a product, incremented by every change in shared mode (0 if the product was never changed).
+  Used with `compare_and_sell` for optimistic concurrency.
+  """
+
+  def get_version(self, product_name):
+      with self.locked():
+        return self._warehouse_reg[product_name].get('version', 0)
 
   """
   def save_product_json(self):
   Method called by functions that manage warehouse operations to save purchases and sales of each product in the warehouse register.
+  Nothing is written if the register did not change since the last save (`_dirty` is False, changes are tracked by `record_changes`).
+  The register is written in compact JSON (without indentation) with `_replace_file_atomically`,
+  so after a crash the file contains either the previous snapshot or the new one, never a partial one.
+  An InventoryStore and its rows are converted to dictionaries by the `default=dict` argument of json.dump.
+  A LazyStore writes the snapshot itself with `write_snapshot`, then saves the index of the new snapshot.
   """
 
+  @_timed("save_product_json")
   def save_product_json(self):
-      with open(self._filename, "w") as json_file:
-        json.dump(self._warehouse_reg, json_file, indent=4)
+      if not self._dirty:
+        if self._metrics is not None:
+          self._metrics.count_event("snapshot_skips")
+        return
+      if isinstance(self._warehouse_reg, LazyStore):
+        _replace_file_atomically(self._filename, self._warehouse_reg.write_snapshot)
+      else:
+        _replace_file_atomically(self._filename,
+                                 lambda json_file: json.dump(self._warehouse_reg, json_file, separators=(",", ":"), default=dict))
+      self._dirty = False
+      self._snapshot_stamp = self._stat_snapshot()
+      if isinstance(self._warehouse_reg, LazyStore):
+        self._warehouse_reg.save_index(self._filename, self._index_filename, self._snapshot_stamp)
+      if self._metrics is not None:
+        self._metrics.count_event("snapshot_writes")
+        self._metrics.add_bytes("snapshot", self._snapshot_stamp[2])
+
+  """
+  def record_change(self, product_name):
+  Method called after every change of a product to make it persistent.
+  Without journal, the whole register is saved with `save_product_json`.
+  In journaled mode, only the new data of the changed product is appended to the journal as one compact line,
+  and the JSON snapshot is rebuilt when the journal grows beyond `_journal_max_bytes`.
+
+  def record_changes(self, product_names):
+  Same as `record_change` for several products at once: the register is saved once,
+  or all the journal lines are appended with a single write, flushed to disk with fsync before returning.
+  In shared mode the version of each changed product is incremented before it is written.
+  `_journal_offset` is moved past the new lines only if the journal ended at `_journal_offset` before the write,
+  so records appended by other processes since the last replay are never skipped: they are applied by the next `refresh`.
+  Inside a `group_commit` block the products are only remembered, and written when the block ends.
+  Both also mark the lines of the changed products in the cached listing to be formatted again.
+  """
+
+  def record_change(self, product_name):
+      self.record_changes([product_name])
+
+  @_timed("record_changes")
+  def record_changes(self, product_names):
+      self._dirty = True
+      self._index_names(product_names)
+      if self._listing_lines is not None:
+        self._stale_lines.update(dict.fromkeys(product_names))
+      if self._pending_changes is not None:
+        self._pending_changes.update(dict.fromkeys(product_names))
+        return
+
+      if not self._journaled:
+        self.save_product_json()
+        return
+
+      lines = []
+      for product_name in product_names:
+        if self._shared:
+          data = self._warehouse_reg[product_name]
+          data['version'] = data.get('version', 0) + 1
+        record = {"product": product_name}
+        record.update(self._warehouse_reg[product_name])
+        lines.append(json.dumps(record, separators=(",", ":")) + "\n")
+      with open(self._journal_filename, "a") as journal_file:
+        start_offset = journal_file.tell()
+        journal_file.write("".join(lines))
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+        journal_size = journal_file.tell()
+      if self._metrics is not None:
+        self._metrics.count_event("journal_writes")
+        self._metrics.add_bytes("journal", journal_size - start_offset)
+      if start_offset == self._journal_offset:
+        self._journal_offset = journal_size
+
+      if journal_size >= self._journal_max_bytes:
+        self.compact_journal()
+
+  """
+  def group_commit(self):
+  Context manager that groups the persistence of all the operations made inside the block:
+  the changed products are written once (a single journal write or snapshot) and the ledger entries
+  in a single transaction when the block ends, instead of once per operation. Nested blocks join the outer one.
+  In shared mode the lock is held for the whole block, so the other tills cannot change the register
+  between the operations of the block and the journal write that persists them.
+  If the block raises an exception, or the ledger transaction fails, nothing is persisted: the ledger group is discarded
+  and the register in memory is loaded again from its files, so none of the operations of the block stays applied.
+  """
+
+  @contextmanager
+  def group_commit(self):
+      if self._pending_changes is not None:
+        yield
+        return
+
+      with self.locked():
+        self._pending_changes = {}
+        self._ledger.begin_group()
+        try:
+          yield
+          self._ledger.commit_group()
+        except BaseException:
+          self._pending_changes = None
+          self._ledger.discard_group()
+          self.open_warehouse_reg_json()
+          raise
+        pending_changes = self._pending_changes
+        self._pending_changes = None
+        if pending_changes:
+          self.record_changes(list(pending_changes))
+
+  """
+  def compact_journal(self):
+  Rebuilds the full JSON snapshot from the register in memory and empties the journal.
+  It is called when the journal passes its size threshold and when the program ends.
+  """
+
+  @_timed("compact_journal")
+  def compact_journal(self):
+      with self.locked():
+        self.save_product_json()
+        if os.path.exists(self._journal_filename):
+          os.remove(self._journal_filename)
+        self._journal_offset = 0
+  """
+  record_events(self, kind, entries):
+  Records an event in the ledger for each entry ({"product", "quantity", "price"}, the shape of the ledger entries),
+  with the state of the product after the change. Called after the register in memory has been changed.
+  """
+
+  def record_events(self, kind, entries):
+      events = []
+      for entry in entries:
+        data = self._warehouse_reg[entry["product"]]
+        events.append({"kind": kind, "product": entry["product"], "quantity": entry["quantity"], "price": entry.get("price"),
+                       "stock": data.get('quantity', 0), "buy_price": data.get('buy_price'),
+                       "sell_price": data.get('sell_price')})
+      self._ledger.record_events(events)
+
   """
   add_product(self, product):
 
@@ -142,44 +1892,39 @@ class Register:
     Checks if the product is already present in the warehouse.
 
     1. If the product is already present:
-    The additional quantity is recorded in the `self._costs` list to maintain the order history.
+    The additional quantity is recorded as a purchase in the ledger to maintain the order history.
     The warehouse register is updated with the newly purchased units.
 
     2. If the product is not present:
     The product is added to the warehouse register.
-    The `self._costs` list is updated with the purchase of the new product.
+    The purchase of the new product is recorded in the ledger.
 
   """
 
+  @_timed("add_product")
   def add_product(self, product):
-      product_name = product.get_name()
-      product_quantity = product.get_quantity()
-      product_buy_price = product.get_buy_price()
-
-      if product_name in self._warehouse_reg:
-            additional_quantity = product_quantity - self._warehouse_reg[product_name]['quantity']
-            if additional_quantity > 0:
-                self._costs.append({
-                    "product": product_name,
-                    "quantity": additional_quantity,
-                    "price": product_buy_price
-                })
-            self._warehouse_reg[product_name]['quantity'] += product.get_quantity()
+      with self.locked():
+        product_name = product.get_name()
+        product_quantity = product.get_quantity()
+        product_buy_price = product.get_buy_price()
 
-      else:
-            self._costs.append({
-                "product": product_name,
-                "quantity": product_quantity,
-                "price": product_buy_price
-            })
+        if product_name in self._warehouse_reg:
+              additional_quantity = product_quantity - self._warehouse_reg[product_name]['quantity']
+              if additional_quantity > 0:
+                  self._ledger.record_purchase(product_name, additional_quantity, product_buy_price)
+              self._warehouse_reg[product_name]['quantity'] += product.get_quantity()
 
-            self._warehouse_reg[product_name] = {
-                'quantity': product.get_quantity(),
-                'buy_price': product.get_buy_price(),
-                'sell_price': product.get_sell_price()
-            }
+        else:
+              self._ledger.record_purchase(product_name, product_quantity, product_buy_price)
 
-      self.save_product_json()
+              self._warehouse_reg[product_name] = {
+                  'quantity': product.get_quantity(),
+                  'buy_price': product.get_buy_price(),
+                  'sell_price': product.get_sell_price()
+              }
+
+        self.record_events("purchase", [{"product": product_name, "quantity": product_quantity, "price": product_buy_price}])
+        self.record_change(product_name)
   """
   sell_product(self, product):
 
@@ -192,59 +1937,218 @@ class Register:
     Operation:
     Checks that `product` is not None.
     Updates the quantity available in the warehouse.
-    Saves the updated register in JSON format.
+    Saves the updated product with `record_change`.
   """
 
+  @_timed("sell_product")
   def sell_product(self, product):
-      if product is None:
-        return
+      with self.locked():
+        if product is None:
+          return
+
+        product_name = product.get_name()
+        existing_product = self._warehouse_reg[product_name]
+        sold_quantity = existing_product['quantity'] - product.get_quantity()
+        existing_product['quantity'] = product.get_quantity()
+        self.record_events("sale", [{"product": product_name, "quantity": -sold_quantity,
+                                     "price": existing_product.get('sell_price')}])
+        self.record_change(product_name)
 
-      product_name = product.get_name()
-      self._warehouse_reg[product_name]['quantity'] = product.get_quantity()
-      self.save_product_json()
+  """
+  add_products(self, products, atomic=True):
+
+  Records the receipt of a whole shipment, for example a supplier delivery.
+
+    Parameters:
+    products (iterable of Product): the received lines. Unlike `add_product`, the quantity of each Product
+                                    is the number of units received, not the new quantity in stock.
+                                    Purchase and selling price are required for products not yet in the warehouse;
+                                    for existing products a missing purchase price defaults to the registered one.
+    atomic (bool, optional): if True, nothing is applied when at least one line is not valid. Default: True.
+
+    Operation:
+    All the lines are validated before changing anything (positive integer quantity, positive prices).
+    In compact mode the quantity in stock after the line must also fit the InventoryStore (at most InventoryStore.MAX_QUANTITY).
+    A selling price given for an existing product is checked too, even if it is only used when the product has none.
+    The valid lines are applied to the register in memory, the purchases are written to the ledger in one transaction
+    and the register is persisted once.
+
+    Result:
+    list of (product name, result) tuples in the order of the lines, where result is RESULT_OK or RESULT_INVALID,
+    or RESULT_NOT_APPLIED for the valid lines of an atomic batch that was not applied.
+  """
+
+  @_timed("add_products")
+  def add_products(self, products, atomic=True):
+      with self.locked():
+        lines = []
+        results = []
+        new_products = {}
+        new_quantities = {}
+        for product in products:
+          product_name = product.get_name()
+          existing_product = self._warehouse_reg.get(product_name, new_products.get(product_name))
+          buy_price = product.get_buy_price()
+          if buy_price is None and existing_product is not None:
+            buy_price = existing_product.get('buy_price')
+
+          valid = (bool(product_name) and is_positive_number(product.get_quantity(), is_float=False)
+                   and is_positive_number(buy_price))
+          if valid and (existing_product is None or product.get_sell_price() is not None):
+            valid = is_positive_number(product.get_sell_price())
+          if valid and self._compact:
+            old_quantity = existing_product.get('quantity', 0) if existing_product is not None else 0
+            new_quantity = new_quantities.get(product_name, old_quantity) + product.get_quantity()
+            valid = new_quantity <= InventoryStore.MAX_QUANTITY
+            if valid:
+              new_quantities[product_name] = new_quantity
+          if valid and existing_product is None:
+            new_products[product_name] = {'buy_price': buy_price}
+
+          lines.append((product, buy_price))
+          results.append((product_name, RESULT_OK if valid else RESULT_INVALID))
+
+        failed = any(result != RESULT_OK for _, result in results)
+        if atomic and failed:
+          return _not_applied(results)
+
+        purchases = []
+        changed = []
+        for (product, buy_price), (product_name, result) in zip(lines, results):
+          if result != RESULT_OK:
+            continue
+          existing_product = self._warehouse_reg.get(product_name)
+          if existing_product is None:
+            self._warehouse_reg[product_name] = {
+                'quantity': product.get_quantity(),
+                'buy_price': buy_price,
+                'sell_price': product.get_sell_price()
+            }
+          else:
+            existing_product['quantity'] += product.get_quantity()
+            existing_product.setdefault('buy_price', buy_price)
+            if product.get_sell_price() is not None:
+              existing_product.setdefault('sell_price', product.get_sell_price())
+          purchases.append({"product": product_name, "quantity": product.get_quantity(), "price": buy_price})
+          if product_name not in changed:
+            changed.append(product_name)
+
+        self._ledger.record_purchases(purchases)
+        self.record_events("purchase", purchases)
+        if changed:
+          self.record_changes(changed)
+        return results
+
+  """
+  sell_products(self, products, atomic=True):
+
+  Records the sale of a whole basket.
+
+    Parameters:
+    products (iterable of Product): the lines of the basket. Unlike `sell_product`, the quantity of each Product
+                                    is the number of units sold, not the quantity left in stock. Prices are taken from the register.
+    atomic (bool, optional): if True, nothing is sold when at least one line cannot be sold. Default: True.
+
+    Operation:
+    All the lines are validated before changing anything; lines of the same product are added together,
+    so the basket can never sell more than the quantity in stock. A product without a selling price cannot be sold.
+    The valid lines are applied to the register in memory, the sales are written to the ledger in one transaction
+    and the register is persisted once.
+
+    Result:
+    list of (product name, result) tuples in the order of the lines, where result is one of
+    RESULT_OK, RESULT_UNKNOWN_PRODUCT, RESULT_NO_SELL_PRICE, RESULT_INSUFFICIENT_STOCK or RESULT_INVALID,
+    or RESULT_NOT_APPLIED for the valid lines of an atomic basket that was not sold.
+  """
+
+  @_timed("sell_products")
+  def sell_products(self, products, atomic=True):
+      with self.locked():
+        lines = []
+        results = []
+        requested = {}
+        for product in products:
+          product_name = product.get_name()
+          quantity = product.get_quantity()
+          if not is_positive_number(quantity, is_float=False):
+            result = RESULT_INVALID
+          elif product_name not in self._warehouse_reg:
+            result = RESULT_UNKNOWN_PRODUCT
+          elif 'sell_price' not in self._warehouse_reg[product_name]:
+            result = RESULT_NO_SELL_PRICE
+          elif requested.get(product_name, 0) + quantity > self._warehouse_reg[product_name]['quantity']:
+            result = RESULT_INSUFFICIENT_STOCK
+          else:
+            result = RESULT_OK
+            requested[product_name] = requested.get(product_name, 0) + quantity
+
+          lines.append(product)
+          results.append((product_name, result))
+
+        failed = any(result != RESULT_OK for _, result in results)
+        if atomic and failed:
+          return _not_applied(results)
+
+        sales = []
+        for product, (product_name, result) in zip(lines, results):
+          if result != RESULT_OK:
+            continue
+          existing_product = self._warehouse_reg[product_name]
+          existing_product['quantity'] -= product.get_quantity()
+          sales.append({"product": product_name, "quantity": product.get_quantity(), "price": existing_product['sell_price']})
+
+        self._ledger.record_sales(sales)
+        self.record_events("sale", [{"product": sale["product"], "quantity": -sale["quantity"], "price": sale["price"]}
+                                    for sale in sales])
+        if requested:
+          self.record_changes(list(requested))
+        return results
+
+  """
+  compare_and_sell(self, product_name, quantity, expected_version):
+
+  Sells `quantity` units of a product only if its version is still `expected_version`, the value read before
+  with `get_version` (optimistic concurrency: the sale is refused if another till changed the product in the meantime).
+
+    Result:
+    RESULT_VERSION_CONFLICT if the version changed, otherwise the result of `sell_products` for the single line.
+  """
+
+  def compare_and_sell(self, product_name, quantity, expected_version):
+      with self.locked():
+        existing_product = self._warehouse_reg.get(product_name)
+        if existing_product is not None and existing_product.get('version', 0) != expected_version:
+          return RESULT_VERSION_CONFLICT
+        return self.sell_products([Product(name=product_name, quantity=quantity)])[0][1]
 
   """
   profits(self):
 
-  Calculates the overall gross profit by accessing the cumulative list of all sales made.
+  Shows the overall gross profit, read from the running totals of the ledger.
   Gross profit is defined as the sum of revenues generated from the sale of each product, equal to selling price * quantity sold.
   """
 
+  @_timed("profits")
   def profits(self):
-        gross_profit = 0
-        for item in self._profits:
-            product_name = item["product"]
-            product_quantity = item["quantity"]
-            unit_price = item["price"]
-
-            revenue = product_quantity * unit_price
-            gross_profit += revenue
-
+        gross_profit = self._ledger.gross_profit()
         print(f"Gross Profit: {gross_profit}\n")
 
   """
   costs(self):
 
-  Calculates the overall costs by accessing the cumulative list of all purchases made.
+  Shows the overall costs, read from the running totals of the ledger.
   Total costs are defined as the sum of costs incurred for the purchase of each product, equal to purchase price * quantity purchased.
-  Finally, it checks if profits from sales have also been recorded in self._profits and if so, calculates the net profit.
+  Finally, it checks if sales have also been recorded in the ledger and if so, shows the net profit.
   Net profit is equal to the sum of all quantities sold and selling prices for each product (gross profit), minus total costs.
   """
 
+  @_timed("costs")
   def costs (self):
-      total_costs=0
-
-      for item in self._costs:
-            product_name = item["product"]
-            product_quantity = item["quantity"]
-            unit_price = item["price"]
-            costs = product_quantity * unit_price
-            total_costs += costs
-
+      total_costs = self._ledger.total_costs()
       print(f"Total Costs: {total_costs}\n")
 
-      if self._profits:
-          net_profit = sum(item["quantity"] * item["price"] for item in self._profits) - total_costs
+      if self._ledger.has_sales():
+          net_profit = self._ledger.net_profit()
           print(f"Net Profit: {net_profit}\n")
 
   """
@@ -252,37 +2156,1150 @@ class Register:
 
   Calculates the total amount sold in the single sales operation, reporting the sales data (product, quantity, price, and total sold) recorded inside the cycle.
   If a subsequent sales operation is carried out, the transaction list is reset, so that the transaction summary does not give a cumulative result of all sales operations.
+  The receipt is built in memory, with the lines formatted by `_receipt_line`, and printed in chunks followed by the total sold.
   """
 
   def transaction (self, transaction_items):
     total_sold =0
+    receipt_lines = []
     for item in transaction_items:
         product_name = item["product"]
         product_quantity = item ["quantity"]
         unit_price = item["price"]
 
-        total_price = product_quantity*unit_price
+        total_sold += product_quantity*unit_price
+        receipt_lines.append(_receipt_line(product_name, product_quantity, unit_price))
 
-        total_sold +=total_price
-
-        print(f"Product: {product_name}, Quantity: {product_quantity}, Unit price: {unit_price}, Total price: {total_price}\n")
-        print(f"Total sold: {total_sold}\n")
+    receipt_lines.append(f"Total sold: {total_sold}\n\n")
+    _print_chunks(receipt_lines)
   """
-  print_warehouse(self):
+  print_warehouse(self, page=None, page_size=LISTING_PAGE_SIZE):
   Lists the products present in the warehouse register (if any) summarizing the product, quantity, and price of each.
   If there are no products in the warehouse, it provides a message informing that the warehouse is empty.
 
+    Parameters:
+    page (int, optional): Number of the page to show, starting from 1. Default: None (all the products).
+    page_size (int, optional): Products on each page. Default: LISTING_PAGE_SIZE.
+
+    Operation:
+    The lines are taken from `listing_lines` and printed in chunks of RENDER_CHUNK_LINES lines.
+
+    Result:
+    The number of pages of the listing (0 if the warehouse is empty).
+
+  listing_lines(self):
+  Returns the cached list of the formatted lines of the products, in the order of the register.
+  The list is built once (in lazy mode after reading all the products with a single pass over the snapshot);
+  afterwards only the lines of the products changed since the previous listing are formatted again,
+  and the lines of new products are appended. The returned list must not be changed.
   """
 
-  def print_warehouse(self):
-      if not self._warehouse_reg:
+  @_timed("print_warehouse")
+  def print_warehouse(self, page=None, page_size=LISTING_PAGE_SIZE):
+      lines = self.listing_lines()
+      if not lines:
           print("\nThe warehouse is empty.\n")
+          return 0
+
+      pages = (len(lines) + page_size - 1) // page_size
+      print("\nPRODUCT QUANTITY PRICE\n")
+      if page is None:
+        _print_chunks(lines)
       else:
-          print("\nPRODUCT QUANTITY PRICE\n")
-          for product, data in self._warehouse_reg.items():
-            quantity = data.get('quantity', 0)
-            price = data.get('sell_price', 0)
-            print(f"{product} {quantity} €{price}\n")
+        _print_chunks(lines[(page - 1) * page_size:page * page_size])
+        print(f"Page {page} of {pages}\n")
+      return pages
+
+  def listing_lines(self):
+      if self._listing_lines is None:
+        self.materialize()
+        self._listing_lines = []
+        self._listing_positions = {}
+        self._stale_lines = dict.fromkeys(self._warehouse_reg)
+
+      for product_name in self._stale_lines:
+        data = self._warehouse_reg.get(product_name)
+        position = self._listing_positions.get(product_name)
+        if data is None:
+          if position is not None:
+            self._listing_lines = None
+            return self.listing_lines()
+          continue
+        line = f"{product_name} {data.get('quantity', 0)} €{data.get('sell_price', 0)}\n\n"
+        if position is None:
+          self._listing_positions[product_name] = len(self._listing_lines)
+          self._listing_lines.append(line)
+        else:
+          self._listing_lines[position] = line
+      self._stale_lines = {}
+      return self._listing_lines
+
+  """
+  columns(self):
+  Returns the tuple (names, quantities, buy_prices, sell_prices) with one column per product attribute, in the same order.
+  With an InventoryStore the columns are returned directly; with a dictionary they are built in one pass,
+  using NaN for missing prices.
+
+  materialize(self):
+  In lazy mode, reads all the products of the snapshot that were not read yet, before a whole-catalog operation.
+  In the other modes the whole register is already in memory and it does nothing.
+  """
+
+  def columns(self):
+      if isinstance(self._warehouse_reg, InventoryStore):
+        return self._warehouse_reg.columns()
+      self.materialize()
+
+      names = list(self._warehouse_reg)
+      rows = self._warehouse_reg.values()
+      quantities = array("q", (data.get('quantity', 0) for data in rows))
+      buy_prices = array("d", (_price_or_nan(data.get('buy_price')) for data in rows))
+      sell_prices = array("d", (_price_or_nan(data.get('sell_price')) for data in rows))
+      return names, quantities, buy_prices, sell_prices
+
+  def materialize(self):
+      if isinstance(self._warehouse_reg, LazyStore):
+        self._warehouse_reg.materialize()
+
+  """
+  iter_products(self):
+  Generator of the products of the warehouse as records ({"product": name, "quantity": ..., ...}),
+  the format used by `write_records` for streaming exports.
+
+  load_records(self, records):
+  Adds or replaces the products of a stream of records, for example from `read_records`,
+  and persists the register once at the end. Returns the number of records loaded.
+  Each loaded product is recorded as an "adjust" event with the change of its quantity.
+  Like the other changes, the whole load runs inside `locked()`, so in shared mode it starts from the changes of the other tills.
+  """
+
+  def iter_products(self):
+      self.materialize()
+      for product_name, data in self._warehouse_reg.items():
+        record = {"product": product_name}
+        record.update(data)
+        yield record
+
+  def load_records(self, records):
+      with self.locked():
+        changed = {}
+        for record in records:
+          product_name = record["product"]
+          old_quantity = self._warehouse_reg[product_name].get('quantity', 0) if product_name in self._warehouse_reg else 0
+          self._warehouse_reg[product_name] = {key: value for key, value in record.items() if key != "product"}
+          quantity_change = self._warehouse_reg[product_name].get('quantity', 0) - old_quantity
+          changed[product_name] = changed.get(product_name, 0) + quantity_change
+        self.record_events("adjust", [{"product": product_name, "quantity": quantity_change}
+                                      for product_name, quantity_change in changed.items()])
+        if changed:
+          self.record_changes(list(changed))
+        return len(changed)
+
+  """
+  reconcile_prices(self, prices):
+
+  Merges a supplier price list into the register, for example the result of `reconcile_price_list`.
+
+    Parameters:
+    prices (iterable of tuples): (product name, buy price, sell price) for each product, already validated.
+
+    Operation:
+    Products not in the warehouse are added with quantity 0; for the others the two prices are replaced.
+    All the changed products are persisted together with one `record_changes` call,
+    so the whole price list is written with a single journal append (or a single save).
+
+    Result:
+    dict with the keys:
+      - "added": list of (name, buy price, sell price) of the new products.
+      - "changed": list of (name, old buy price, old sell price, buy price, sell price).
+      - "unchanged": list of the names whose prices were already the same.
+      - "negative_margin": list of the names whose new sell price is lower than the buy price.
+                           These products are updated anyway, so that the register matches the supplier list.
+  """
+
+  @_timed("reconcile_prices")
+  def reconcile_prices(self, prices):
+      with self.locked():
+        report = {"added": [], "changed": [], "unchanged": [], "negative_margin": []}
+        changed = {}
+        for product_name, buy_price, sell_price in prices:
+          existing_product = self._warehouse_reg.get(product_name)
+          if existing_product is None:
+            self._warehouse_reg[product_name] = {'quantity': 0, 'buy_price': buy_price, 'sell_price': sell_price}
+            report["added"].append((product_name, buy_price, sell_price))
+          else:
+            old_buy_price = existing_product.get('buy_price')
+            old_sell_price = existing_product.get('sell_price')
+            if old_buy_price == buy_price and old_sell_price == sell_price:
+              report["unchanged"].append(product_name)
+              continue
+            existing_product['buy_price'] = buy_price
+            existing_product['sell_price'] = sell_price
+            report["changed"].append((product_name, old_buy_price, old_sell_price, buy_price, sell_price))
+
+          changed[product_name] = True
+          if sell_price < buy_price:
+            report["negative_margin"].append(product_name)
+
+        self.record_events("price", [{"product": product_name, "quantity": 0, "price": self._warehouse_reg[product_name]['sell_price']}
+                                     for product_name in changed])
+        if changed:
+          self.record_changes(list(changed))
+        return report
+
+"""
+    Computes the inventory analytics of a register in one pass over its columns.
+
+    The columns returned by `Register.columns()` are combined element by element with `map` and the functions
+    of the `operator` module, so the loops run inside the interpreter's C code instead of Python bytecode.
+    Products without a purchase or selling price have NaN margins and are left out of the stock values
+    (`max(0.0, nan)` is 0.0, which is used to rank them last without a Python-level check).
+    A selling price of 0 is replaced by NaN before dividing, so its margin percentage is NaN instead of an error.
+
+    Arguments:
+    warehouse_reg (Register): The instance of the warehouse register.
+    reorder_threshold (int, optional): Products with a quantity below this value are reported as low stock. Default: 5.
+    top_n (int, optional): Number of products reported in the ranking by stock value. Default: 10.
+
+    Result:
+    dict with the keys:
+      - "products": number of products in the warehouse.
+      - "stock_value_buy" / "stock_value_sell": total value of the stock at purchase and at selling price.
+      - "names": product names, in the order of the following columns.
+      - "margins": array of sell_price - buy_price for each product.
+      - "margin_percentages": array of margin / sell_price * 100 for each product (NaN if sell_price is missing or 0).
+      - "top_by_value": list of the top_n (name, stock value at selling price) tuples, highest first.
+      - "low_stock": list of (name, quantity) tuples of the products below reorder_threshold.
+"""
+
+def inventory_analytics(warehouse_reg, reorder_threshold=5, top_n=10):
+    names, quantities, buy_prices, sell_prices = warehouse_reg.columns()
+
+    buy_values = array("d", map(operator.mul, quantities, buy_prices))
+    sell_values = array("d", map(operator.mul, quantities, sell_prices))
+    margins = array("d", map(operator.sub, sell_prices, buy_prices))
+    divisors = map(_nonzero_or_nan, sell_prices)
+    margin_percentages = array("d", map(operator.mul, map(operator.truediv, margins, divisors), repeat(100.0)))
+
+    ranking = heapq.nlargest(top_n, zip(map(max, repeat(0.0), sell_values), range(len(names))))
+    is_low = list(map(operator.gt, repeat(reorder_threshold), quantities))
+
+    return {
+        "products": len(names),
+        "stock_value_buy": math.fsum(filter(math.isfinite, buy_values)),
+        "stock_value_sell": math.fsum(filter(math.isfinite, sell_values)),
+        "names": names,
+        "margins": margins,
+        "margin_percentages": margin_percentages,
+        "top_by_value": [(names[row], value) for value, row in ranking],
+        "low_stock": list(zip(compress(names, is_low), compress(quantities, is_low))),
+    }
+
+"""
+    The ReorderEngine class forecasts when each product will run out of stock and suggests the purchases to make.
+
+    The sales velocity of each product (units sold per day) is an exponentially weighted moving average of its daily sales,
+    read from the daily rollups of the ledger. The averages are updated incrementally: `update` reads only the days
+    after the last day already folded in, and saves the new state in the ledger, so running the engine after every
+    store close reads one day of rollups instead of the whole history. Days without sales are applied as a decay
+    of the average when it is used (a factor (1 - alpha) per day), so products that stop selling are not rewritten every day.
+
+    The forecast for the whole catalog is computed on the columns of `Register.columns()`, combined element by element
+    with `map` and the functions of the `operator` module like `inventory_analytics`; only the products that must be
+    reordered are handled one by one.
+
+    Instance attributes:
+    _warehouse_reg (Register): The instance of the warehouse register.
+    _span_days (float): Span of the moving average; alpha = 2 / (span_days + 1). Default: 7.
+    _lead_time_days (float): Days between the order and the delivery. A product is reordered when its stock
+      lasts less than the lead time at the current velocity. Default: 7.
+    _coverage_days (float): Days of sales covered by an order, after the delivery. Default: 14.
+    _folded_day (str): Last complete day ("YYYY-MM-DD") included in the velocities, None before the first update.
+    _velocities (dict): product name -> (velocity at the end of last day, last day with sales as a date ordinal).
+
+    Methods:
+    update(self, today=None):
+    Folds the days between the last update and the day before `today` ("YYYY-MM-DD", default: the current local date)
+    into the velocities and saves them in the ledger. The sales of `today` itself are not folded, since the day is not over.
+    If the span changed since the velocities were saved, they are computed again from the whole history.
+
+    forecast(self, today=None):
+    Calls `update`, then returns a dict with the keys:
+      - "names": product names, in the order of the following columns.
+      - "velocities": array of the units sold per day, counting the sales of `today`.
+      - "days_to_stockout": array of the days until each product runs out (math.inf for products that are not selling).
+      - "suggestions": list of Product objects, one per product to reorder, with the quantity to buy and the registered
+        prices, ready for `Register.add_products`.
+"""
+
+class ReorderEngine:
+
+  def __init__(self, warehouse_reg, span_days=7, lead_time_days=7, coverage_days=14):
+    self._warehouse_reg = warehouse_reg
+    self._span_days = span_days
+    self._lead_time_days = lead_time_days
+    self._coverage_days = coverage_days
+    ledger = warehouse_reg.get_ledger()
+    saved_span_days, self._folded_day, self._velocities = ledger.load_velocities()
+    if saved_span_days != span_days:
+      self._folded_day = None
+      self._velocities = {}
+      ledger.save_velocities(None, None, {})
+
+  def _alpha(self):
+      return 2 / (self._span_days + 1)
+
+  def update(self, today=None):
+      today = today or time.strftime("%Y-%m-%d")
+      yesterday = datetime.fromordinal(datetime.fromisoformat(today).toordinal() - 1).strftime("%Y-%m-%d")
+      if self._folded_day is not None and self._folded_day >= yesterday:
+        return
+
+      alpha = self._alpha()
+      changed = {}
+      for day, product_name, quantity in self._warehouse_reg.get_ledger().daily_sales(self._folded_day, yesterday):
+        day_number = datetime.fromisoformat(day).toordinal()
+        velocity, last_day = changed.get(product_name) or self._velocities.get(product_name, (0.0, day_number - 1))
+        velocity *= (1 - alpha) ** (day_number - last_day - 1)
+        changed[product_name] = (alpha * quantity + (1 - alpha) * velocity, day_number)
+
+      self._velocities.update(changed)
+      self._folded_day = yesterday
+      self._warehouse_reg.get_ledger().save_velocities(self._span_days, yesterday, changed)
+
+  def forecast(self, today=None):
+      today = today or time.strftime("%Y-%m-%d")
+      self.update(today)
+      alpha = self._alpha()
+      today_number = datetime.fromisoformat(today).toordinal()
+
+      sold_today = {product_name: quantity
+                    for _, product_name, quantity in self._warehouse_reg.get_ledger().daily_sales(
+                      datetime.fromordinal(today_number - 1).strftime("%Y-%m-%d"), today)}
+      products = list(self._velocities.keys() | sold_today.keys())
+      saved = list(map(self._velocities.get, products, repeat((0.0, today_number - 1))))
+      decays = map(pow, repeat(1 - alpha), map(operator.sub, repeat(today_number - 1), map(operator.itemgetter(1), saved)))
+      previous_velocities = map(operator.mul, map(operator.itemgetter(0), saved), decays)
+      current_velocities = map(operator.add, map(operator.mul, repeat(alpha), map(sold_today.get, products, repeat(0))),
+                               map(operator.mul, repeat(1 - alpha), previous_velocities))
+      velocity_of = dict(zip(products, current_velocities))
+
+      names, quantities, buy_prices, sell_prices = self._warehouse_reg.columns()
+      velocities = array("d", map(velocity_of.get, names, repeat(0.0)))
+      days_to_stockout = array("d", map(_days_of_stock, quantities, velocities))
+      is_due = list(map(operator.and_, map(operator.gt, velocities, repeat(0.0)),
+                        map(operator.lt, days_to_stockout, repeat(self._lead_time_days))))
+
+      suggestions = []
+      target_days = self._lead_time_days + self._coverage_days
+      for product_name, quantity, velocity, buy_price, sell_price in zip(
+          compress(names, is_due), compress(quantities, is_due), compress(velocities, is_due),
+          compress(buy_prices, is_due), compress(sell_prices, is_due)):
+        order_quantity = math.ceil(velocity * target_days - quantity)
+        if order_quantity > 0:
+          suggestions.append(Product(name=product_name, quantity=order_quantity,
+                                     buy_price=None if math.isnan(buy_price) else buy_price,
+                                     sell_price=None if math.isnan(sell_price) else sell_price))
+
+      return {"names": names, "velocities": velocities, "days_to_stockout": days_to_stockout, "suggestions": suggestions}
+
+
+def _days_of_stock(quantity, velocity):
+    return quantity / velocity if velocity > 0 else math.inf
+
+"""
+    The ShopService class is the programmatic interface of the shop: it offers the operations of the menu
+    (add, sell, list, report) without any `input()` prompt or printed message, so the program can be used as a library.
+    Each method returns its result as data; the results of add and sell are the ones of the batch methods of Register.
+
+    Instance attributes:
+    _warehouse_reg (Register): The instance of the warehouse register.
+
+    Methods:
+    add(self, name, quantity, buy_price=None, sell_price=None):
+    Registers the purchase of `quantity` units of a product. Prices are required if the product is new.
+    Returns RESULT_OK or RESULT_INVALID.
+
+    sell(self, items, atomic=True):
+    Sells a basket, given as a list of (name, quantity) tuples. Returns the list of (name, result) tuples of `sell_products`.
+
+    list_products(self):
+    Returns the list of products in the warehouse as dictionaries with "product", "quantity" and "sell_price".
+
+    listing(self, page=None, page_size=LISTING_PAGE_SIZE):
+    Returns the formatted lines of the listing (all of them, or only the ones of `page`) and the number of pages,
+    taken from the cached `Register.listing_lines`.
+
+    profits(self):
+    Returns gross profit, total costs and net profit from the ledger, and "has_sales" to tell if any sale was recorded.
+
+    report(self, reorder_threshold=5, top_n=10):
+    Returns the `profits` of the shop, plus the `inventory_analytics` of the warehouse.
+
+    apply_operations(self, operations, batch_size=1000):
+    Applies a sequence of operations (dictionaries with "op" equal to "add" or "sell", "product", "quantity",
+    and optionally "buy_price" and "sell_price"), for example read with `read_operations`.
+    Consecutive operations of the same type are grouped in batches of up to `batch_size` lines,
+    so the register is persisted once per batch. Lines that cannot be applied are skipped, not the whole batch.
+    Returns the list of (name, result) tuples in the order of the operations.
+"""
+
+class ShopService:
+
+  def __init__(self, warehouse_reg):
+    self._warehouse_reg = warehouse_reg
+
+  def get_warehouse_reg(self):
+    return self._warehouse_reg
+
+  def add(self, name, quantity, buy_price=None, sell_price=None):
+      product = Product(name=name, quantity=quantity, buy_price=buy_price, sell_price=sell_price)
+      return self._warehouse_reg.add_products([product])[0][1]
+
+  def sell(self, items, atomic=True):
+      products = [Product(name=name, quantity=quantity) for name, quantity in items]
+      return self._warehouse_reg.sell_products(products, atomic=atomic)
+
+  def list_products(self):
+      self._warehouse_reg.materialize()
+      return [{"product": product_name, "quantity": data.get('quantity', 0), "sell_price": data.get('sell_price')}
+              for product_name, data in self._warehouse_reg.get_warehouse_reg().items()]
+
+  def listing(self, page=None, page_size=LISTING_PAGE_SIZE):
+      lines = self._warehouse_reg.listing_lines()
+      pages = (len(lines) + page_size - 1) // page_size
+      if page is not None:
+        lines = lines[(page - 1) * page_size:page * page_size]
+      return lines, pages
+
+  def profits(self):
+      ledger = self._warehouse_reg.get_ledger()
+      return {
+          "gross_profit": ledger.gross_profit(),
+          "total_costs": ledger.total_costs(),
+          "net_profit": ledger.net_profit(),
+          "has_sales": ledger.has_sales(),
+      }
+
+  def report(self, reorder_threshold=5, top_n=10):
+      report = self.profits()
+      del report["has_sales"]
+      report["inventory"] = inventory_analytics(self._warehouse_reg, reorder_threshold, top_n)
+      return report
+
+  def apply_operations(self, operations, batch_size=1000):
+      results = []
+      batch = []
+      batch_op = None
+      for operation in operations:
+        op = operation.get("op")
+        if op not in ("add", "sell"):
+          results.extend(self._apply_batch(batch_op, batch))
+          batch = []
+          results.append((operation.get("product"), RESULT_INVALID))
+          continue
+
+        if op != batch_op or len(batch) >= batch_size:
+          results.extend(self._apply_batch(batch_op, batch))
+          batch = []
+          batch_op = op
+        batch.append(Product(name=operation.get("product"), quantity=operation.get("quantity"),
+                             buy_price=operation.get("buy_price"), sell_price=operation.get("sell_price")))
+
+      results.extend(self._apply_batch(batch_op, batch))
+      return results
+
+  def _apply_batch(self, op, batch):
+      if not batch:
+        return []
+      if op == "add":
+        return self._warehouse_reg.add_products(batch, atomic=False)
+      return self._warehouse_reg.sell_products(batch, atomic=False)
+
+"""
+    Reads a file of operations for `ShopService.apply_operations`, one operation at a time.
+
+    The format is chosen from the file extension:
+    .csv: a header with the columns op, product, quantity, buy_price, sell_price (the prices may be empty).
+    .jsonl: one JSON object per line with the same keys.
+
+    Product names are normalized with `.strip().title()` like in the menu, quantities given as text are converted to int
+    and prices to float. Values that cannot be converted are passed unchanged, so they are reported as not valid.
+    A .jsonl line that is not valid JSON, is not a JSON object, or whose "op" or "product" is not a string
+    is read as an operation without "op", which `apply_operations` reports as RESULT_INVALID.
+
+    Arguments:
+    filename (str): Name of the file to read.
+
+    Result:
+    generator of dictionaries, one per operation.
+
+    Exception handling:
+    ValueError: If the file extension is not .csv or .jsonl.
+"""
+
+def read_operations(filename):
+    if filename.endswith(".csv"):
+      with open(filename, newline="") as operations_file:
+        for row in csv.DictReader(operations_file):
+          yield _normalize_operation(row)
+    elif filename.endswith(".jsonl"):
+      with open(filename) as operations_file:
+        for line in operations_file:
+          if not line.strip():
+            continue
+          try:
+            row = json.loads(line)
+          except ValueError:
+            row = None
+          yield _normalize_operation(row) if _is_operation(row) else {"op": None, "product": None}
+    else:
+      raise ValueError(f"Unsupported operations file: {filename}. Use a .csv or .jsonl file.")
+
+
+def _is_operation(event):
+    return (isinstance(event, dict)
+            and all(isinstance(event.get(key), (str, type(None))) for key in ("op", "product")))
+
+
+def _normalize_operation(row):
+    operation = {"op": (row.get("op") or "").strip().lower(),
+                 "product": (row.get("product") or "").strip().title()}
+    for key, convert in (("quantity", int), ("buy_price", float), ("sell_price", float)):
+      value = row.get(key)
+      if value in (None, ""):
+        operation[key] = None
+        continue
+      try:
+        operation[key] = convert(value) if isinstance(value, str) else value
+      except ValueError:
+        operation[key] = value
+    return operation
+
+"""
+    The ShardedRegister class manages the registers of all the stores of the chain.
+
+    Inventory and ledger are partitioned by store: each store has its own directory with its own
+    warehouse_register.json and warehouse_ledger.db, so a save only rewrites the files of one store.
+    With product_shards > 1 the products of each store are further split by a hash of the name
+    into the subdirectories shard-0, shard-1, ... each with its own files.
+
+    Chain-wide queries run `_shard_summary` on every shard in a pool of worker processes and merge the partial results.
+    Each worker reads the files of its shard, snapshot plus journal, so the registers must be journaled
+    (the default) or saved before the query to include the latest changes.
+
+    Instance attributes:
+    _directory (str): Directory containing one subdirectory per store.
+    _product_shards (int): Number of shards of the products of each store.
+    _register_options (dict): Other arguments given to every Register (for example compact=True).
+    _registers (dict): (store, shard) -> Register, opened on first use.
+
+    Methods:
+    get_register(self, store, product_name=None):
+    Returns the Register of the store that contains `product_name` (the first shard if product_name is None).
+
+    add_products(self, store, products) / sell_products(self, store, products):
+    Split the lines by shard and call the batch methods of each Register. The results are in the order of the lines;
+    every shard is atomic on its own, but a batch spanning several shards is not atomic as a whole.
+
+    stores(self):
+    Returns the names of the stores, in alphabetical order.
+
+    chain_summary(self, processes=None):
+    Returns {"stock": {product: quantity in all the stores}, "stores": {store: {"gross_profit", "total_costs", "net_profit"}},
+    "gross_profit", "total_costs", "net_profit"} for the whole chain. processes is the number of worker processes
+    (None: one per CPU; 1: everything runs in this process).
+"""
+
+class ShardedRegister:
+
+  def __init__(self, directory="stores", product_shards=1, **register_options):
+    self._directory = directory
+    self._product_shards = product_shards
+    self._register_options = dict(register_options)
+    self._register_options.setdefault("journaled", True)
+    self._registers = {}
+    os.makedirs(directory, exist_ok=True)
+
+  def _shard_of(self, product_name):
+      if self._product_shards == 1 or product_name is None:
+        return 0
+      return zlib.crc32(product_name.encode()) % self._product_shards
+
+  def _shard_directory(self, store, shard):
+      if self._product_shards == 1:
+        return os.path.join(self._directory, store)
+      return os.path.join(self._directory, store, f"shard-{shard}")
+
+  def _shard_files(self, store, shard):
+      shard_directory = self._shard_directory(store, shard)
+      return (os.path.join(shard_directory, "warehouse_register.json"),
+              os.path.join(shard_directory, "warehouse_ledger.db"))
+
+  def get_register(self, store, product_name=None):
+      shard = self._shard_of(product_name)
+      warehouse_reg = self._registers.get((store, shard))
+      if warehouse_reg is None:
+        os.makedirs(self._shard_directory(store, shard), exist_ok=True)
+        filename, ledger_filename = self._shard_files(store, shard)
+        warehouse_reg = Register(filename=filename, ledger_filename=ledger_filename, **self._register_options)
+        self._registers[(store, shard)] = warehouse_reg
+      return warehouse_reg
+
+  def stores(self):
+      return sorted(entry.name for entry in os.scandir(self._directory) if entry.is_dir())
+
+  def add_products(self, store, products):
+      return self._batch(store, products, "add_products")
+
+  def sell_products(self, store, products):
+      return self._batch(store, products, "sell_products")
+
+  def _batch(self, store, products, method):
+      lines_by_shard = {}
+      for line_number, product in enumerate(products):
+        lines_by_shard.setdefault(self._shard_of(product.get_name()), []).append((line_number, product))
+
+      results = {}
+      for shard, lines in lines_by_shard.items():
+        warehouse_reg = self.get_register(store, lines[0][1].get_name())
+        shard_results = getattr(warehouse_reg, method)([product for _, product in lines])
+        for (line_number, _), result in zip(lines, shard_results):
+          results[line_number] = result
+      return [results[line_number] for line_number in range(len(results))]
+
+  def chain_summary(self, processes=None):
+      shards = []
+      for store in self.stores():
+        for shard in range(self._product_shards):
+          filename, ledger_filename = self._shard_files(store, shard)
+          if os.path.exists(filename) or os.path.exists(filename + ".log"):
+            shards.append((store, filename, ledger_filename, self._register_options.get("journaled")))
+
+      if processes == 1:
+        summaries = [_shard_summary(shard) for shard in shards]
+      else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+          summaries = list(executor.map(_shard_summary, shards))
+
+      chain = {"stock": {}, "stores": {}, "gross_profit": 0, "total_costs": 0, "net_profit": 0}
+      for store, stock, revenue, cost in summaries:
+        for product_name, quantity in stock.items():
+          chain["stock"][product_name] = chain["stock"].get(product_name, 0) + quantity
+        store_totals = chain["stores"].setdefault(store, {"gross_profit": 0, "total_costs": 0, "net_profit": 0})
+        for totals in (store_totals, chain):
+          totals["gross_profit"] += revenue
+          totals["total_costs"] += cost
+          totals["net_profit"] += revenue - cost
+      return chain
+
+
+"""
+Helper function of ShardedRegister, run in the worker processes: reads one shard and returns its partial results
+
+The shard is only read, never changed, because the tills of the store may be using it at the same time:
+the snapshot is streamed with `_read_json_records`, the complete records of the journal are applied on top of it
+with `_read_journal_records` (a torn last record is skipped, not truncated), and the totals are read from
+a read-only connection to the ledger, so no snapshot, checkpoint or journal compaction is written.
+
+Parameters:
+shard (tuple): (store, register file name, ledger file name, journaled)
+
+Returns:
+tuple: (store, {product: quantity}, revenue, cost)
+"""
+def _shard_summary(shard):
+    store, filename, ledger_filename, journaled = shard
+    stock = {}
+    if os.path.exists(filename):
+      for record in _read_json_records(filename):
+        stock[record["product"]] = record.get('quantity', 0)
+    if journaled:
+      for record, _ in _read_journal_records(filename + ".log"):
+        stock[record["product"]] = record.get('quantity', 0)
+
+    revenue, cost = 0, 0
+    if os.path.exists(ledger_filename):
+      connection = sqlite3.connect(f"file:{pathname2url(os.path.abspath(ledger_filename))}?mode=ro", uri=True)
+      try:
+        revenue, cost = connection.execute("SELECT revenue, cost FROM ledger_totals WHERE id = 1").fetchone()
+      finally:
+        connection.close()
+    return store, stock, revenue, cost
+
+
+"""
+Reads the complete records of a journal written by `Register.record_changes`, starting at byte `offset`.
+The reading stops at the first record torn by a crash during the write (invalid JSON or missing final newline);
+the file is never changed.
+
+Parameters:
+journal_filename (str): Name of the journal file. A missing file has no records.
+offset (int, optional): Position of the first record to read. Default: 0.
+
+Returns:
+generator of (record, end) tuples, where `end` is the position just after the record.
+"""
+def _read_journal_records(journal_filename, offset=0):
+    if not os.path.exists(journal_filename):
+      return
+    with open(journal_filename, "rb") as journal_file:
+      journal_file.seek(offset)
+      for line in journal_file:
+        if not line.endswith(b"\n"):
+          return
+        try:
+          record = json.loads(line)
+        except ValueError:
+          return
+        offset += len(line)
+        yield record, offset
+
+"""
+    Bulk reconciliation of a supplier price list with the register.
+
+    The price list is a .csv file with the columns product, buy_price, sell_price, or a .jsonl file with one object
+    per line with the same keys. This process only splits the file into blocks of about `chunk_size` raw lines
+    (a .csv block never ends inside a quoted field); every block is parsed and validated by `_validate_price_chunk`
+    in a pool of worker processes, with the same rules as `validate_numeric_input`: both prices must be positive numbers.
+    Product names are normalized with `.strip().title()` like in the menu. Lines that are not valid JSON,
+    or not a JSON object, are rejected like the rows with invalid prices.
+
+    The valid rows are then merged into the register by `Register.reconcile_prices` in this process, in a single commit.
+    A product listed more than once is rejected after its first row, so the result never depends on the order
+    in which the chunks are processed.
+
+    Arguments:
+    warehouse_reg (Register): The instance of the warehouse register.
+    filename (str): Name of the price list.
+    processes (int, optional): Number of worker processes (None: one per CPU; 1: everything runs in this process).
+    chunk_size (int, optional): Lines parsed and validated by each task. Default: 10000.
+
+    Result:
+    The dict returned by `Register.reconcile_prices`, with the additional key
+    "rejected": list of (line number, product, reason) of the rows that were not applied.
+
+    Exception handling:
+    ValueError: If the file extension is not .csv or .jsonl.
+"""
+
+def reconcile_price_list(warehouse_reg, filename, processes=None, chunk_size=10000):
+    chunks = _price_list_chunks(filename, chunk_size)
+    if processes == 1:
+      validated_chunks = map(_validate_price_chunk, chunks)
+      return _merge_price_chunks(warehouse_reg, validated_chunks)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+      return _merge_price_chunks(warehouse_reg, executor.map(_validate_price_chunk, chunks))
+
+
+def _price_list_chunks(filename, chunk_size):
+    if filename.endswith(".csv"):
+      price_file = open(filename, newline="")
+    elif filename.endswith(".jsonl"):
+      price_file = open(filename)
+    else:
+      raise ValueError(f"Unsupported price list: {filename}. Use a .csv or .jsonl file.")
+
+    with price_file:
+      fieldnames = None
+      first_line = 1
+      if filename.endswith(".csv"):
+        header = csv.reader(price_file)
+        fieldnames = next(header, None)
+        first_line += header.line_num
+
+      lines = []
+      quotes = 0
+      for line in price_file:
+        lines.append(line)
+        if fieldnames is not None:
+          quotes += line.count('"')
+        if len(lines) >= chunk_size and quotes % 2 == 0:
+          yield first_line, fieldnames, lines
+          first_line += len(lines)
+          lines = []
+      if lines:
+        yield first_line, fieldnames, lines
+
+
+def _merge_price_chunks(warehouse_reg, validated_chunks):
+    prices = []
+    rejected = []
+    seen = set()
+    for validated_chunk in validated_chunks:
+      for line_number, product_name, buy_price, sell_price, reason in validated_chunk:
+        if reason is None and product_name in seen:
+          reason = "duplicate product"
+        if reason is not None:
+          rejected.append((line_number, product_name, reason))
+          continue
+        seen.add(product_name)
+        prices.append((product_name, buy_price, sell_price))
+
+    report = warehouse_reg.reconcile_prices(prices)
+    report["rejected"] = rejected
+    return report
+
+
+"""
+Helper function of reconcile_price_list, run in the worker processes: parses and validates one chunk of the price list
+
+Parameters:
+chunk (tuple): (number of the first line, .csv column names or None for .jsonl, list of the raw lines)
+
+Returns:
+list: (line number, product, buy price, sell price, reason) tuples, where reason is None for a valid row
+"""
+def _validate_price_chunk(chunk):
+    first_line, fieldnames, lines = chunk
+    validated = []
+    if fieldnames is not None:
+      reader = csv.DictReader(lines, fieldnames=fieldnames)
+      line_number = first_line
+      for row in reader:
+        validated.append(_validate_price_row(line_number, row))
+        line_number = first_line + reader.line_num
+      return validated
+
+    for line_number, line in enumerate(lines, start=first_line):
+      if not line.strip():
+        continue
+      try:
+        row = json.loads(line)
+      except ValueError:
+        validated.append((line_number, "", None, None, "invalid JSON"))
+        continue
+      if not isinstance(row, dict):
+        validated.append((line_number, "", None, None, "not a JSON object"))
+        continue
+      validated.append(_validate_price_row(line_number, row))
+    return validated
+
+
+def _validate_price_row(line_number, row):
+    product_name = row.get("product")
+    product_name = product_name.strip().title() if isinstance(product_name, str) else ""
+    prices = []
+    reason = None if product_name else "missing product name"
+    for key in ("buy_price", "sell_price"):
+      value = row.get(key)
+      try:
+        value = float(value) if isinstance(value, str) else value
+      except ValueError:
+        pass
+      if reason is None and not is_positive_number(value):
+        reason = f"invalid {key}"
+      prices.append(value)
+    return line_number, product_name, prices[0], prices[1], reason
+
+"""
+Writes the report of `reconcile_price_list` as a .csv file with one row per product of the price list
+
+Parameters:
+report (dict): The result of `reconcile_price_list`
+filename (str): Name of the .csv file
+
+Returns:
+int: The number of rows written
+"""
+def write_price_report(report, filename):
+    negative_margin = set(report["negative_margin"])
+    with open(filename, "w", newline="") as report_file:
+      writer = csv.writer(report_file)
+      writer.writerow(("status", "product", "old_buy_price", "old_sell_price", "buy_price", "sell_price", "note"))
+      rows = 0
+      for product_name, buy_price, sell_price in report["added"]:
+        note = "negative margin" if product_name in negative_margin else ""
+        writer.writerow(("added", product_name, "", "", buy_price, sell_price, note))
+        rows += 1
+      for product_name, old_buy_price, old_sell_price, buy_price, sell_price in report["changed"]:
+        note = "negative margin" if product_name in negative_margin else ""
+        writer.writerow(("changed", product_name, old_buy_price, old_sell_price, buy_price, sell_price, note))
+        rows += 1
+      for product_name in report["unchanged"]:
+        writer.writerow(("unchanged", product_name, "", "", "", "", ""))
+        rows += 1
+      for line_number, product_name, reason in report["rejected"]:
+        writer.writerow(("rejected", product_name, "", "", "", "", f"line {line_number}: {reason}"))
+        rows += 1
+    return rows
+
+"""
+    The RegisterServer class is a long-running asyncio service that owns a Register in memory and receives
+    sale and purchase events from many clients over a local TCP socket.
+
+    Protocol: one JSON object per line in both directions. Requests have the keys of `ShopService.apply_operations`
+    ({"op": "sell", "product": "Tofu", "quantity": 2}, or "add" with optional prices); each one gets back
+    {"product": name, "result": result} in the same order, so clients can send many requests without waiting.
+    {"op": "metrics"} returns the metrics of the server instead.
+    Lines that are not a JSON object, or whose "op" or "product" is not a string, get {"product": null, "result": "invalid"}.
+    If a batch cannot be applied or persisted, none of its events is applied (see `Register.group_commit`), each of them
+    gets {"product": name, "result": "error", "error": message}, so clients can safely send them again, and the connections stay open.
+
+    Events go through a bounded queue to a single committer task, which takes all the events waiting
+    (up to `max_batch`), applies them in memory and persists them with one `Register.group_commit` flush (group commit).
+    Clients get their results only after the flush. When the queue is full, the readers stop accepting new requests
+    until there is room again (backpressure), and the waits are counted in the metrics.
+    Without shared mode the server must be the only process changing the register files while it runs;
+    in shared mode each flush holds the lock of the register, so tills can work on the same files.
+
+    Instance attributes:
+    _warehouse_reg (Register): The register owned by the server.
+    _service (ShopService): Applies the events to the register.
+    _host, _port: Address of the socket. Default: 127.0.0.1 and 8765.
+    _queue (asyncio.Queue): Events waiting to be applied, with at most `max_queue` elements.
+    _max_batch (int): Maximum number of events covered by one flush.
+    _metrics (dict): Counters returned by `metrics`.
+
+    Methods:
+    serve_forever(self): starts the socket server and the committer task and runs until cancelled.
+    metrics(self): returns events, flushes, events per flush, current and maximum queue depth,
+                   backpressure waits and events per second since the start.
+"""
+
+class RegisterServer:
+
+  def __init__(self, warehouse_reg, host="127.0.0.1", port=8765, max_queue=10000, max_batch=1000):
+    self._warehouse_reg = warehouse_reg
+    self._service = ShopService(warehouse_reg)
+    self._host = host
+    self._port = port
+    self._queue = None
+    self._max_queue = max_queue
+    self._max_batch = max_batch
+    self._started = None
+    self._metrics = {"events": 0, "flushes": 0, "max_queue_depth": 0, "backpressure_waits": 0, "clients": 0}
+
+  def metrics(self):
+      metrics = dict(self._metrics)
+      metrics["queue_depth"] = self._queue.qsize() if self._queue is not None else 0
+      metrics["events_per_flush"] = metrics["events"] / metrics["flushes"] if metrics["flushes"] else 0
+      elapsed = time.monotonic() - self._started if self._started is not None else 0
+      metrics["events_per_second"] = metrics["events"] / elapsed if elapsed else 0
+      return metrics
+
+  async def serve_forever(self):
+      self._queue = asyncio.Queue(self._max_queue)
+      self._started = time.monotonic()
+      committer = asyncio.ensure_future(self._commit_events())
+      server = await asyncio.start_server(self._handle_client, self._host, self._port)
+      try:
+        async with server:
+          await server.serve_forever()
+      finally:
+        committer.cancel()
+
+  async def _handle_client(self, reader, writer):
+      self._metrics["clients"] += 1
+      responses = asyncio.Queue()
+      sender = asyncio.ensure_future(self._send_responses(responses, writer))
+      try:
+        while True:
+          line = await reader.readline()
+          if not line:
+            break
+          future = asyncio.get_running_loop().create_future()
+          try:
+            event = json.loads(line)
+          except ValueError:
+            event = None
+          if not _is_operation(event):
+            future.set_result({"product": None, "result": RESULT_INVALID})
+            await responses.put(future)
+            continue
+
+          if event.get("op") == "metrics":
+            future.set_result(self.metrics())
+          else:
+            if self._queue.full():
+              self._metrics["backpressure_waits"] += 1
+            await self._queue.put((_normalize_operation(event), future))
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self._queue.qsize())
+          await responses.put(future)
+      finally:
+        await responses.put(None)
+        await sender
+        writer.close()
+
+  async def _send_responses(self, responses, writer):
+      while True:
+        future = await responses.get()
+        if future is None:
+          return
+        writer.write((json.dumps(await future) + "\n").encode())
+        if responses.empty():
+          await writer.drain()
+
+  async def _commit_events(self):
+      while True:
+        batch = [await self._queue.get()]
+        while len(batch) < self._max_batch and not self._queue.empty():
+          batch.append(self._queue.get_nowait())
+
+        try:
+          with self._warehouse_reg.group_commit():
+            results = self._service.apply_operations([operation for operation, _ in batch])
+        except Exception as e:
+          for operation, future in batch:
+            future.set_result({"product": operation["product"], "result": RESULT_ERROR, "error": str(e)})
+          continue
+
+        self._metrics["events"] += len(batch)
+        self._metrics["flushes"] += 1
+        for (_, future), (product_name, result) in zip(batch, results):
+          future.set_result({"product": product_name, "result": result})
+
+"""
+    Streaming readers and writers of the warehouse register.
+
+    All of them work one product at a time, so files of any size are read and written in constant memory.
+    A product is represented by a record, the same dictionary used by the journal:
+    {"product": name, "quantity": ..., "buy_price": ..., "sell_price": ...}, where missing prices are left out.
+
+    Supported formats, chosen from the file extension:
+    .json: the format of warehouse_register.json, {name: {"quantity": ..., "buy_price": ..., "sell_price": ...}, ...},
+           with or without indentation. It is read by an incremental parser working on blocks of the file.
+    .jsonl: one record per line.
+    .csv: a header with the columns product, quantity, buy_price, sell_price (empty cells for missing prices).
+
+    read_records(filename): generator of the records of the file.
+    write_records(records, filename): writes the records to the file and returns how many were written.
+
+    Exception handling:
+    ValueError: If the file extension is not supported.
+    json.JSONDecodeError: If a .json or .jsonl file is not valid.
+"""
+
+STREAM_BLOCK_SIZE = 64 * 1024
+_JSON_SEPARATORS = re.compile(r"[\s,]*")
+_JSON_DECODER = json.JSONDecoder()
+
+
+def read_records(filename):
+    if filename.endswith(".jsonl"):
+      return _read_jsonl_records(filename)
+    if filename.endswith(".csv"):
+      return _read_csv_records(filename)
+    if filename.endswith(".json"):
+      return _read_json_records(filename)
+    raise ValueError(f"Unsupported register file: {filename}. Use a .json, .jsonl or .csv file.")
+
+
+def write_records(records, filename):
+    if filename.endswith(".jsonl"):
+      return _write_jsonl_records(records, filename)
+    if filename.endswith(".csv"):
+      return _write_csv_records(records, filename)
+    if filename.endswith(".json"):
+      return _write_json_records(records, filename)
+    raise ValueError(f"Unsupported register file: {filename}. Use a .json, .jsonl or .csv file.")
+
+
+def _read_json_records(filename):
+    with open(filename, "r") as json_file:
+      buffer = ""
+      position = 0
+      at_end = False
+
+      def read_more():
+          nonlocal buffer, position, at_end
+          block = json_file.read(STREAM_BLOCK_SIZE)
+          if not block:
+            at_end = True
+          buffer = buffer[position:] + block
+          position = 0
+
+      def next_token():
+          nonlocal position
+          while True:
+            position = _JSON_SEPARATORS.match(buffer, position).end()
+            if position < len(buffer) or at_end:
+              return buffer[position:position + 1]
+            read_more()
+
+      def next_value():
+          nonlocal position
+          while True:
+            try:
+              value, position = _JSON_DECODER.raw_decode(buffer, position)
+              return value
+            except json.JSONDecodeError:
+              if at_end:
+                raise
+              read_more()
+
+      read_more()
+      if next_token() != "{":
+        raise json.JSONDecodeError("Expecting '{'", buffer, position)
+      position += 1
+
+      while True:
+        token = next_token()
+        if token == "}":
+          return
+        if token != '"':
+          raise json.JSONDecodeError("Expecting product name", buffer, position)
+        product_name = next_value()
+        if next_token() != ":":
+          raise json.JSONDecodeError("Expecting ':'", buffer, position)
+        position += 1
+        next_token()
+        record = {"product": product_name}
+        record.update(next_value())
+        yield record
+
+
+def _write_json_records(records, filename):
+    count = 0
+    with open(filename, "w") as json_file:
+      json_file.write("{")
+      for record in records:
+        data = {key: value for key, value in record.items() if key != "product"}
+        json_file.write("," if count else "")
+        json_file.write(f"\n    {json.dumps(record['product'])}: {json.dumps(data)}")
+        count += 1
+      json_file.write("\n}" if count else "}")
+    return count
+
+
+def _read_jsonl_records(filename):
+    with open(filename, "r") as jsonl_file:
+      for line in jsonl_file:
+        if line.strip():
+          yield json.loads(line)
+
+
+def _write_jsonl_records(records, filename):
+    count = 0
+    with open(filename, "w") as jsonl_file:
+      for record in records:
+        jsonl_file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        count += 1
+    return count
+
+
+_CSV_COLUMNS = ("product", "quantity", "buy_price", "sell_price")
+
+
+def _read_csv_records(filename):
+    with open(filename, "r", newline="") as csv_file:
+      for row in csv.DictReader(csv_file):
+        record = {"product": row["product"], "quantity": int(row["quantity"])}
+        for key in ("buy_price", "sell_price"):
+          if row.get(key):
+            record[key] = float(row[key])
+        yield record
+
+
+def _write_csv_records(records, filename):
+    count = 0
+    with open(filename, "w", newline="") as csv_file:
+      writer = csv.DictWriter(csv_file, fieldnames=_CSV_COLUMNS, extrasaction="ignore")
+      writer.writeheader()
+      for record in records:
+        writer.writerow(record)
+        count += 1
+    return count
 
 """
 Helper function to validate numeric input
@@ -313,6 +3330,24 @@ def validate_numeric_input(prompt, is_float=True, positive_only=True):
         except ValueError:
             print("\nInvalid input. Please enter a valid number.\n")
 
+"""
+Helper function to check a value that is already a number, with the same rules as `validate_numeric_input`
+Used where the values do not come from the keyboard, for example by the batch methods of Register
+
+Parameters:
+value: The value to check
+is_float (bool): Whether to accept floating point numbers, otherwise only integers are accepted
+
+Returns:
+bool: True if the value is a positive number of the requested type
+"""
+def is_positive_number(value, is_float=True):
+    if isinstance(value, bool):
+        return False
+    if is_float:
+        return isinstance(value, (int, float)) and value > 0
+    return isinstance(value, int) and value > 0
+
 """
 Helper function to validate yes/no responses
 
@@ -337,13 +3372,14 @@ def validate_yes_no_input(prompt):
 
     This function asks the user to enter the necessary information for a new product (name, quantity, purchase price, and selling price) not present in the warehouse.
     If the product already exists, it only asks for the additional quantity if the selling price and purchase price are present in the register, otherwise it also asks to add this information.
+    The register is not changed: the product is then registered with `ShopService.add`.
     Handles input validation and displays appropriate error messages.
 
     Arguments:
     warehouse_reg (Register): The instance of the warehouse register.
 
     Result:
-    Product: returns a new Product object with the information entered by the user.
+    Product: returns a new Product object with the information entered by the user, whose quantity is the number of units received.
 
     Exception handling:
     AssertionError: If the user's input is not valid.
@@ -363,24 +3399,24 @@ def input_add_product(warehouse_reg):
           print(f"Quantity added to {add_new_product} equal to {quantity_to_add}.\n")
 
           existing_product = warehouse_reg.get_warehouse_reg()[add_new_product]
+          buy_price = existing_product.get('buy_price')
+          sell_price = existing_product.get('sell_price')
 
-          if 'buy_price' not in existing_product or 'sell_price' not in existing_product:
+          if buy_price is None or sell_price is None:
                     print(f"The existing product {add_new_product} does not have a registered purchase or selling price.")
                     buy_price = validate_numeric_input("Purchase price: \n", is_float=True, positive_only=True)
                     sell_price = validate_numeric_input("Selling price: \n", is_float=True, positive_only=True)
 
-                    existing_product['buy_price'] = buy_price
-                    existing_product['sell_price'] = sell_price
-
 
           return Product(name=add_new_product,
-                      quantity=existing_product['quantity'] + quantity_to_add,
-                      buy_price=existing_product['buy_price'],
-                      sell_price=existing_product['sell_price'])
-
-          warehouse_reg._costs.append({"product": add_new_product, "quantity": quantity_to_add, "price": buy_price})
+                      quantity=quantity_to_add,
+                      buy_price=buy_price,
+                      sell_price=sell_price)
 
         else:
+          similar_products = warehouse_reg.get_name_index().closest(add_new_product, limit=3)
+          if similar_products:
+            print(f"\nSimilar products already in warehouse: {', '.join(similar_products)}\n")
           buy_price = validate_numeric_input("Purchase price: \n", is_float=True, positive_only=True)
           sell_price = validate_numeric_input("Selling price: \n", is_float=True, positive_only=True)
           quantity = validate_numeric_input("Quantity: \n", is_float=False, positive_only=True)
@@ -396,13 +3432,14 @@ def input_add_product(warehouse_reg):
     Manages user input to record the sale of a product.
 
     This function asks the user to enter the necessary information to sell a product present in the warehouse (name and quantity)
-    If the product is not present in the warehouse, it reports this and asks the user to try again.
-    If the product is present in the warehouse, it records the sale and asks the user if they want to continue by adding another product.
+    If the product is not present in the warehouse, it reports this, suggests the most similar product names and asks the user to try again.
+    If the product is present in the warehouse, it records the sale with `ShopService.sell`, which checks and decrements
+    the stock in a single step (also when several tills share the register), and asks the user if they want to continue by adding another product.
     When the user decides to end the sales process, a summary of the sale is displayed with information on the products sold and the total selling price.
     Handles input validation and displays appropriate error messages.
 
     Arguments:
-    warehouse_reg (Register): The instance of the warehouse register.
+    shop_service (ShopService): The service of the shop, over the warehouse register.
     transaction: the list that records warehouse movements in the sales cycle to summarize the total sold at the end of the operation.
 
     Result:
@@ -412,7 +3449,8 @@ def input_add_product(warehouse_reg):
     AssertionError: If the user's input is not valid.
 """
 
-def input_sell_product(warehouse_reg, transaction):
+def input_sell_product(shop_service, transaction):
+  warehouse_reg = shop_service.get_warehouse_reg()
   while True:
     try:
       sell_product = input("Product name to sell: \n").strip().title()
@@ -420,6 +3458,9 @@ def input_sell_product(warehouse_reg, transaction):
 
       if not sell_product in warehouse_reg.get_warehouse_reg():
           print(f"Product {sell_product} not present in warehouse.\n")
+          suggestions = warehouse_reg.get_name_index().closest(sell_product, limit=3)
+          if suggestions:
+            print(f"Did you mean: {', '.join(suggestions)}?\n")
 
           if validate_yes_no_input(f"Try with another product? [yes/no]\n"):
               continue
@@ -427,34 +3468,58 @@ def input_sell_product(warehouse_reg, transaction):
               return None
 
       else:
-        existing_product = warehouse_reg.get_warehouse_reg()[sell_product]
-        sell_price = existing_product['sell_price']
-        
         quantity_to_sell = validate_numeric_input("Quantity: \n", is_float=False, positive_only=True)
-        
-        if quantity_to_sell > existing_product['quantity']:
+
+        result = shop_service.sell([(sell_product, quantity_to_sell)])[0][1]
+        if result == RESULT_NO_SELL_PRICE:
+          print(f"The product {sell_product} does not have a registered selling price\n")
+          return None
+        if result != RESULT_OK:
           print(f"You are selling a quantity of {sell_product} not available in warehouse\n")
           return None
-          
-        existing_product['quantity'] -= quantity_to_sell
+
+        existing_product = warehouse_reg.get_warehouse_reg()[sell_product]
+        sell_price = existing_product['sell_price']
         print(f"Sale Registered\n {quantity_to_sell}X {sell_product}: {sell_price}.\n")
-        warehouse_reg.save_product_json()
 
         transaction.append({"product":sell_product, "quantity":quantity_to_sell, "price":sell_price})
-        warehouse_reg._profits.append({"product": sell_product, "quantity": quantity_to_sell, "price": sell_price})
 
         if validate_yes_no_input(f"Add another product? [yes/no]\n"):
            continue
         else:
           return Product(name=sell_product,
             quantity=existing_product['quantity'],
-            buy_price=existing_product['buy_price'],
+            buy_price=existing_product.get('buy_price'),
             sell_price=existing_product['sell_price'])
 
     except AssertionError as e:
       print("\nAn error occurred:", e)
 
 
+"""
+    Shows a page of the listing of the warehouse, taken from `ShopService.listing`.
+    If there are no products in the warehouse, it provides a message informing that the warehouse is empty.
+
+    Arguments:
+    shop_service (ShopService): The service of the shop, over the warehouse register.
+    page (int): Number of the page to show, starting from 1.
+
+    Result:
+    The number of pages of the listing (0 if the warehouse is empty).
+"""
+
+def print_listing_page(shop_service, page):
+    lines, pages = shop_service.listing(page)
+    if not pages:
+      print("\nThe warehouse is empty.\n")
+      return 0
+
+    print("\nPRODUCT QUANTITY PRICE\n")
+    _print_chunks(lines)
+    print(f"Page {page} of {pages}\n")
+    return pages
+
+
 """
     Main function of the warehouse management program.
 
@@ -462,13 +3527,131 @@ def input_sell_product(warehouse_reg, transaction):
     and manages the main program cycle, presenting a menu
     to the user and calling the appropriate functions based on the user's choices.
 
-"""
-def main():
-
-
-  warehouse_reg = Register()
-  profits=[]
+    Command line options:
+    --batch FILE: applies the operations of a .csv or .jsonl file (see `read_operations`) without starting the menu,
+                  then prints how many operations were applied and the ones that were rejected.
+    --import FILE: adds or replaces the products of a .json, .jsonl or .csv file (see `read_records`) and exits.
+    --export FILE: writes the products of the warehouse to a .json, .jsonl or .csv file and exits.
+    --convert SOURCE TARGET: converts a register file to another format in constant memory, without loading it.
+    --shared: opens the register in shared mode, to run several tills on the same files at the same time.
+    --serve PORT: runs a RegisterServer on 127.0.0.1:PORT until interrupted with Ctrl+C.
+    --metrics: measures the operations of the register; the `stats` command shows them and saves them in warehouse_metrics.json.
+    --profile: like --metrics, also running cProfile and tracemalloc.
+    --prices FILE: merges a supplier price list (.csv or .jsonl) and writes the differences to price_report.csv.
+    --lazy: reads the products from the register file only when they are used, for a faster startup with large catalogs.
+    --stock-at WHEN: prints the stock of every product at the date and time WHEN (for example 2026-03-03T18:00) and exits.
+    --reorder: updates the sales velocities, prints the products to reorder with the suggested quantities and exits.
+    --store NAME: uses the register of the store NAME, in the "stores" directory, instead of the files in the current directory.
+    --chain-report: prints stock and profits of all the stores in the "stores" directory and exits.
 
+"""
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Vegan shop management software")
+  parser.add_argument("--batch", metavar="FILE", help="apply the operations of a .csv or .jsonl file and exit")
+  parser.add_argument("--import", dest="import_file", metavar="FILE", help="load the products of a .json, .jsonl or .csv file and exit")
+  parser.add_argument("--export", metavar="FILE", help="write the products to a .json, .jsonl or .csv file and exit")
+  parser.add_argument("--convert", nargs=2, metavar=("SOURCE", "TARGET"), help="convert a register file to another format and exit")
+  parser.add_argument("--shared", action="store_true", help="share the register with other tills running at the same time")
+  parser.add_argument("--serve", type=int, metavar="PORT", help="receive sales and purchases on a local socket")
+  parser.add_argument("--metrics", action="store_true", help="measure the operations of the register (see the stats command)")
+  parser.add_argument("--profile", action="store_true", help="like --metrics, also with cProfile and tracemalloc")
+  parser.add_argument("--prices", metavar="FILE", help="merge a supplier price list (.csv or .jsonl)")
+  parser.add_argument("--lazy", action="store_true", help="read the products only when they are used")
+  parser.add_argument("--stock-at", metavar="WHEN", help="print the stock at a date and time, for example 2026-03-03T18:00")
+  parser.add_argument("--reorder", action="store_true", help="print the products to reorder and exit")
+  parser.add_argument("--store", metavar="NAME", help="use the register of the store NAME in the stores directory")
+  parser.add_argument("--chain-report", action="store_true", help="print stock and profits of all the stores and exit")
+  args = parser.parse_args(argv)
+
+  if args.chain_report:
+    chain = ShardedRegister().chain_summary()
+    print("\nSTORE GROSS PROFIT TOTAL COSTS NET PROFIT\n")
+    for store, totals in chain["stores"].items():
+      print(f"{store} {totals['gross_profit']} {totals['total_costs']} {totals['net_profit']}\n")
+    print(f"Chain: Gross Profit: {chain['gross_profit']}, Total Costs: {chain['total_costs']}, Net Profit: {chain['net_profit']}\n")
+    print("\nPRODUCT QUANTITY\n")
+    for product_name, quantity in sorted(chain["stock"].items()):
+      print(f"{product_name} {quantity}\n")
+    return
+
+  if args.convert:
+    count = write_records(read_records(args.convert[0]), args.convert[1])
+    print(f"Products converted: {count}\n")
+    return
+
+  metrics = RegisterMetrics(profile=args.profile) if args.metrics or args.profile else None
+  if args.store:
+    warehouse_reg = ShardedRegister(shared=args.shared, metrics=metrics, lazy=args.lazy).get_register(args.store)
+  else:
+    warehouse_reg = Register(journaled=True, shared=args.shared, metrics=metrics, lazy=args.lazy)
+
+  if args.import_file:
+    count = warehouse_reg.load_records(read_records(args.import_file))
+    warehouse_reg.compact_journal()
+    print(f"Products imported: {count}\n")
+    return
+
+  if args.export:
+    count = write_records(warehouse_reg.iter_products(), args.export)
+    print(f"Products exported: {count}\n")
+    return
+
+  if args.prices:
+    report = reconcile_price_list(warehouse_reg, args.prices)
+    warehouse_reg.compact_journal()
+    write_price_report(report, "price_report.csv")
+    print(f"Added: {len(report['added'])}, Changed: {len(report['changed'])}, "
+          f"Unchanged: {len(report['unchanged'])}, Rejected: {len(report['rejected'])}\n")
+    for product_name in report["negative_margin"]:
+      print(f"Negative margin: {product_name}")
+    print("Differences saved in price_report.csv\n")
+    return
+
+  if args.reorder:
+    forecast = ReorderEngine(warehouse_reg).forecast()
+    days_of = dict(zip(forecast["names"], forecast["days_to_stockout"]))
+    velocity_of = dict(zip(forecast["names"], forecast["velocities"]))
+    if not forecast["suggestions"]:
+      print("\nNo product needs to be reordered.\n")
+      return
+    print("\nPRODUCT DAILY SALES DAYS LEFT ORDER QUANTITY\n")
+    for product in forecast["suggestions"]:
+      product_name = product.get_name()
+      print(f"{product_name} {velocity_of[product_name]:.2f} {days_of[product_name]:.1f} {product.get_quantity()}\n")
+    return
+
+  if args.stock_at:
+    stock = warehouse_reg.get_ledger().inventory_at(datetime.fromisoformat(args.stock_at).timestamp())
+    if stock is None:
+      print(f"\nNo history is available for {args.stock_at}.\n")
+      return
+    print(f"\nSTOCK AT {args.stock_at}\n\nPRODUCT QUANTITY PRICE\n")
+    for product_name, data in stock.items():
+      print(f"{product_name} {data['quantity']} €{data['sell_price']}\n")
+    return
+
+  if args.serve:
+    print(f"Register server listening on 127.0.0.1:{args.serve}\n")
+    try:
+      asyncio.run(RegisterServer(warehouse_reg, port=args.serve).serve_forever())
+    except KeyboardInterrupt:
+      pass
+    warehouse_reg.compact_journal()
+    return
+
+  shop_service = ShopService(warehouse_reg)
+
+  if args.batch:
+    results = shop_service.apply_operations(read_operations(args.batch))
+    warehouse_reg.compact_journal()
+    applied = sum(1 for _, result in results if result == RESULT_OK)
+    print(f"Operations applied: {applied} of {len(results)}\n")
+    for number, (product_name, result) in enumerate(results, start=1):
+      if result != RESULT_OK:
+        print(f"Operation {number}: {product_name}: {result}")
+    return
+
+  warehouse_reg.start_name_index()
   try:
       cmd = None
       while cmd!="exit":
@@ -477,8 +3660,10 @@ def main():
                   "2. list\n"
                   "3. sale\n"
                   "4. profits\n"
-                  "5. help\n"
-                  "6. exit\n").strip()
+                  "5. search\n"
+                  "6. stats\n"
+                  "7. help\n"
+                  "8. exit\n").strip()
 
 
         assert cmd != "", "Enter the name of the chosen operation.\n"
@@ -486,32 +3671,63 @@ def main():
         if cmd =="add":
           print("\nYou requested operation 1: Register a new product\n")
           new_product = input_add_product(warehouse_reg)
-          warehouse_reg.add_product(new_product)
+          if new_product is not None:
+            result = shop_service.add(new_product.get_name(), new_product.get_quantity(),
+                                      new_product.get_buy_price(), new_product.get_sell_price())
+            if result != RESULT_OK:
+              print(f"\nThe product {new_product.get_name()} was not registered: {result}\n")
 
         elif cmd =="list":
           print("\nYou requested operation 2: List products in warehouse\n")
-          warehouse_reg.print_warehouse()
+          page = 1
+          pages = print_listing_page(shop_service, page)
+          while page < pages and input("Press Enter for the next page, or q to return to the menu: \n").strip().lower() != "q":
+            page += 1
+            print_listing_page(shop_service, page)
 
         elif cmd =="sale":
           transaction= []
           print("\nYou requested operation 3: Register a sale\n")
-          sell_product = input_sell_product(warehouse_reg, transaction)
-          warehouse_reg.sell_product(sell_product)
+          input_sell_product(shop_service, transaction)
           warehouse_reg.transaction(transaction)
 
         elif cmd =="profits":
-          warehouse_reg.profits()
-          warehouse_reg.costs()
+          profits = shop_service.profits()
+          print(f"Gross Profit: {profits['gross_profit']}\n")
+          print(f"Total Costs: {profits['total_costs']}\n")
+          if profits["has_sales"]:
+            print(f"Net Profit: {profits['net_profit']}\n")
+
+        elif cmd =="search":
+          search_text = input("Product name or beginning of the name: \n").strip()
+          name_index = warehouse_reg.get_name_index()
+          found_products = name_index.starting_with(search_text) or name_index.closest(search_text)
+          if found_products:
+            print("\n" + "\n".join(found_products) + "\n")
+          else:
+            print("\nNo product found.\n")
+
+        elif cmd =="stats":
+          if metrics is None:
+            print("\nMetrics are disabled: start the program with --metrics or --profile.\n")
+          else:
+            print(f"\n{metrics.report()}\n")
+            with open("warehouse_metrics.json", "w") as metrics_file:
+              json.dump(metrics.dump(), metrics_file, indent=4)
+            print("Metrics saved in warehouse_metrics.json\n")
 
         elif cmd =="help":
           print("1. add: register new products, with name, quantity, selling price and purchase price.\n"
                   "2. list: list all products present in the warehouse.\n"
                   "3. sale: register sales made for each product and display the receipt.\n"
                   "4. profits: show total gross and net profits accumulated.\n"
-                  "5. help: display the menu with the description of commands\n"
-                  "6. exit: terminate program execution.\n")
+                  "5. search: find products by the beginning of the name, or by a similar name.\n"
+                  "6. stats: show the timings of the register operations (with --metrics or --profile).\n"
+                  "7. help: display the menu with the description of commands\n"
+                  "8. exit: terminate program execution.\n")
 
         elif cmd =="exit":
+          warehouse_reg.compact_journal()
           print("bye bye\n")
         else:
           print("The command you entered is not valid, try again!\n")
@@ -521,4 +3737,5 @@ def main():
 
   print(f"End\n.")
 
-main()
+if __name__ == "__main__":
+  main()
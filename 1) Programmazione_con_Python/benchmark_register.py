@@ -0,0 +1,242 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+"""
+    Benchmark of the hot paths of the Register class of Vegan-shop-managment-software.py.
+
+    For each catalog size, a synthetic register (and optionally a ledger of sales) is generated in a temporary
+    directory, then the following operations are measured:
+    startup (Register() with open_warehouse_reg_json), add_product, sell_product, profits, costs and print_warehouse.
+
+    For each operation the results report: number of operations, ops/sec, p50 and p99 latency in milliseconds,
+    bytes written per operation (from /proc/self/io, Linux only) and the peak RSS of the process after the operation.
+    Everything printed by the program is discarded while measuring.
+
+    The results are saved as JSON; with --compare the results of a previous run are read and the ratio
+    between the new and the old ops/sec is printed for each catalog size and operation.
+
+    Usage:
+    python benchmark_register.py --products 1000,100000 --sales 1000000 --output results.json
+    python benchmark_register.py --products 1000,100000 --compare results.json
+"""
+
+PROGRAM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Vegan-shop-managment-software.py")
+
+
+"""
+Loads the program as a module (its file name is not a valid module name, so it cannot be imported directly)
+"""
+def load_program():
+    spec = importlib.util.spec_from_file_location("vegan_shop", PROGRAM_FILE)
+    program = importlib.util.module_from_spec(spec)
+    sys.modules["vegan_shop"] = program
+    spec.loader.exec_module(program)
+    return program
+
+
+"""
+Helper functions to read the bytes written and the peak memory of the process
+They return None where the information is not available (bytes written are read from /proc, so only on Linux)
+"""
+def bytes_written():
+    try:
+      with open("/proc/self/io") as io_file:
+        for line in io_file:
+          if line.startswith("wchar:"):
+            return int(line.split()[1])
+    except OSError:
+      return None
+    return None
+
+
+def peak_rss_kb():
+    if resource is None:
+      return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+"""
+Generates the synthetic catalog and ledger
+
+Parameters:
+program (module): The loaded program
+directory (str): Directory where the register files are created
+products (int): Number of products of the catalog
+sales (int): Number of sales recorded in the ledger
+seed (int): Seed of the random generator, so that the same arguments always produce the same data
+
+Returns:
+list: The product names of the catalog
+"""
+def generate_register(program, directory, products, sales, seed):
+    generator = random.Random(seed)
+    names = [f"Product {number:07d}" for number in range(products)]
+
+    def records():
+        for name in names:
+          buy_price = round(generator.uniform(0.5, 20), 2)
+          yield {"product": name, "quantity": generator.randint(100, 10000),
+                 "buy_price": buy_price, "sell_price": round(buy_price * generator.uniform(1.1, 2), 2)}
+
+    program.write_records(records(), os.path.join(directory, "warehouse_register.json"))
+
+    ledger = program.Ledger(os.path.join(directory, "warehouse_ledger.db"))
+    batch_size = 100000
+    for start in range(0, sales, batch_size):
+      ledger.record_sales({"product": names[generator.randrange(products)], "quantity": generator.randint(1, 5),
+                           "price": round(generator.uniform(1, 40), 2), "timestamp": start + offset}
+                          for offset in range(min(batch_size, sales - start)))
+    ledger.close()
+    return names
+
+
+"""
+Runs `operation` once for each element of `arguments` and returns the measures of the run
+
+Parameters:
+name (str): Name of the operation in the results
+operation (function): The measured function, called with one element of `arguments`
+arguments (list): The arguments of the calls, prepared before the measure
+
+Returns:
+dict: The measures of the operation
+"""
+def measure(name, operation, arguments):
+    latencies = []
+    written_before = bytes_written()
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+      for argument in arguments:
+        start = time.perf_counter()
+        operation(argument)
+        latencies.append(time.perf_counter() - start)
+        output.seek(0)
+        output.truncate()
+    written_after = bytes_written()
+
+    total = sum(latencies)
+    latencies.sort()
+    return {
+        "operation": name,
+        "ops": len(latencies),
+        "ops_per_sec": len(latencies) / total if total else None,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "bytes_per_op": (written_after - written_before) / len(latencies) if written_before is not None else None,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+"""
+Runs all the measures for one catalog size
+
+Parameters:
+program (module): The loaded program
+products (int): Number of products of the catalog
+arguments (argparse.Namespace): The command line arguments
+
+Returns:
+list: The measures of each operation
+"""
+def benchmark_catalog(program, products, arguments):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+      names = generate_register(program, directory, products, arguments.sales, arguments.seed)
+      options = {"filename": os.path.join(directory, "warehouse_register.json"),
+                 "ledger_filename": os.path.join(directory, "warehouse_ledger.db"),
+                 "journaled": arguments.journaled, "compact": arguments.compact}
+
+      results.append(measure("startup", lambda _: program.Register(**options), range(arguments.startup_runs)))
+      with contextlib.redirect_stdout(io.StringIO()):
+        warehouse_reg = program.Register(**options)
+
+      generator = random.Random(arguments.seed)
+      additions = [program.Product(name=f"New product {number}", quantity=10, buy_price=1.0, sell_price=2.0)
+                   for number in range(arguments.ops)]
+      results.append(measure("add_product", warehouse_reg.add_product, additions))
+
+      register = warehouse_reg.get_warehouse_reg()
+      sales = []
+      for name in (names[generator.randrange(products)] for _ in range(arguments.ops)):
+        sales.append(program.Product(name=name, quantity=register[name]['quantity'] - 1))
+      results.append(measure("sell_product", warehouse_reg.sell_product, sales))
+
+      results.append(measure("profits", lambda _: warehouse_reg.profits(), range(arguments.ops)))
+      results.append(measure("costs", lambda _: warehouse_reg.costs(), range(arguments.ops)))
+      results.append(measure("print_warehouse", lambda _: warehouse_reg.print_warehouse(), range(arguments.report_runs)))
+
+      warehouse_reg.get_ledger().close()
+
+    for result in results:
+      result["products"] = products
+      result["sales"] = arguments.sales
+    return results
+
+
+"""
+Prints the ratio between the new and the old ops/sec of each catalog size and operation
+A ratio below 1 means that the operation became slower
+"""
+def compare(results, old_filename):
+    with open(old_filename) as old_file:
+      old_results = {(result["products"], result["operation"]): result for result in json.load(old_file)["results"]}
+
+    print(f"{'products':>10} {'operation':<16} {'old ops/s':>12} {'new ops/s':>12} {'ratio':>7}")
+    for result in results:
+      old = old_results.get((result["products"], result["operation"]))
+      if old is None or not old["ops_per_sec"] or not result["ops_per_sec"]:
+        continue
+      ratio = result["ops_per_sec"] / old["ops_per_sec"]
+      print(f"{result['products']:>10} {result['operation']:<16} {old['ops_per_sec']:>12.1f} "
+            f"{result['ops_per_sec']:>12.1f} {ratio:>7.2f}")
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark of the Register hot paths")
+  parser.add_argument("--products", default="1000,10000,100000",
+                      help="comma separated catalog sizes, for example 1000,1000000 (default: 1000,10000,100000)")
+  parser.add_argument("--sales", type=int, default=100000, help="sales in the generated ledger (default: 100000)")
+  parser.add_argument("--ops", type=int, default=200, help="measured calls of each operation (default: 200)")
+  parser.add_argument("--startup-runs", type=int, default=5, help="measured startups (default: 5)")
+  parser.add_argument("--report-runs", type=int, default=5, help="measured print_warehouse calls (default: 5)")
+  parser.add_argument("--journaled", action="store_true", help="benchmark the journaled storage mode")
+  parser.add_argument("--compact", action="store_true", help="benchmark the InventoryStore")
+  parser.add_argument("--seed", type=int, default=1, help="seed of the synthetic data (default: 1)")
+  parser.add_argument("--output", default="benchmark_results.json", help="JSON file of the results")
+  parser.add_argument("--compare", metavar="FILE", help="JSON results of a previous run to compare with")
+  arguments = parser.parse_args(argv)
+
+  program = load_program()
+  results = []
+  for products in (int(size) for size in arguments.products.split(",")):
+    catalog_results = benchmark_catalog(program, products, arguments)
+    for result in catalog_results:
+      print(f"{result['products']:>10} {result['operation']:<16} {result['ops_per_sec'] or 0:>12.1f} ops/s "
+            f"p50 {result['p50_ms']:.3f} ms  p99 {result['p99_ms']:.3f} ms")
+    results.extend(catalog_results)
+
+  with open(arguments.output, "w") as output_file:
+    json.dump({"python": platform.python_version(), "platform": platform.platform(), "time": time.time(),
+               "arguments": vars(arguments), "results": results}, output_file, indent=4)
+  print(f"\nResults saved in {arguments.output}\n")
+
+  if arguments.compare:
+    compare(results, arguments.compare)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,290 @@
+import contextlib
+import importlib.util
+import io
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+"""
+    Regression tests of Vegan-shop-managment-software.py, run with `python -m pytest`.
+
+    The program is loaded as a module like in benchmark_register.py, and every test works on the files
+    of its own temporary directory. The messages printed by the program are discarded.
+"""
+
+PROGRAM_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Vegan-shop-managment-software.py")
+
+
+def load_program():
+    spec = importlib.util.spec_from_file_location("vegan_shop", PROGRAM_FILE)
+    program = importlib.util.module_from_spec(spec)
+    sys.modules["vegan_shop"] = program
+    spec.loader.exec_module(program)
+    return program
+
+
+shop = load_program()
+
+
+@pytest.fixture(autouse=True)
+def quiet():
+    with contextlib.redirect_stdout(io.StringIO()):
+      yield
+
+
+def new_register(tmp_path, **options):
+    return shop.Register(filename=str(tmp_path / "warehouse_register.json"), **options)
+
+
+def test_group_commit_in_shared_mode_keeps_the_sales_of_the_other_tills(tmp_path):
+    till_a = new_register(tmp_path, shared=True)
+    till_a.add_products([shop.Product("Seitan", 10, 1.0, 2.0), shop.Product("Tofu", 10, 1.0, 2.0)])
+
+    opened = threading.Event()
+    results = []
+
+    def sell_on_till_b():
+        till_b = new_register(tmp_path, shared=True)
+        opened.set()
+        results.extend(till_b.sell_products([shop.Product("Seitan", 4)]))
+
+    till_b_thread = threading.Thread(target=sell_on_till_b)
+    with till_a.group_commit():
+      till_a.sell_products([shop.Product("Tofu", 1)])
+      till_b_thread.start()
+      opened.wait()
+      time.sleep(0.2)
+    till_b_thread.join()
+
+    assert results == [("Seitan", shop.RESULT_OK)]
+    assert till_a.sell_products([shop.Product("Seitan", 10)]) == [("Seitan", shop.RESULT_INSUFFICIENT_STOCK)]
+    assert till_a.get_warehouse_reg()["Seitan"]["quantity"] == 6
+    assert new_register(tmp_path, shared=True).get_warehouse_reg()["Tofu"]["quantity"] == 9
+
+
+def test_failed_group_commit_applies_nothing(tmp_path):
+    warehouse_reg = new_register(tmp_path, journaled=True, compact=True)
+    warehouse_reg.add_products([shop.Product("Tofu", 10, 1.0, 2.0)])
+
+    with pytest.raises(RuntimeError):
+      with warehouse_reg.group_commit():
+        warehouse_reg.sell_products([shop.Product("Tofu", 3)])
+        raise RuntimeError("flush failed")
+
+    assert warehouse_reg.get_warehouse_reg()["Tofu"]["quantity"] == 10
+    assert warehouse_reg.get_ledger().gross_profit() == 0
+    reopened = new_register(tmp_path, journaled=True, compact=True)
+    assert reopened.get_warehouse_reg()["Tofu"]["quantity"] == 10
+    assert reopened.get_ledger().history("Tofu")[-1]["kind"] == "purchase"
+
+
+@pytest.mark.parametrize("sell_price", [-7, "abc"])
+def test_add_products_rejects_an_invalid_selling_price_for_an_existing_product(tmp_path, sell_price):
+    warehouse_reg = new_register(tmp_path)
+    warehouse_reg.load_records([{"product": "Tofu", "quantity": 5, "buy_price": 1.0}])
+
+    results = warehouse_reg.add_products([shop.Product("Tofu", 2, 1.0, sell_price)])
+
+    assert results == [("Tofu", shop.RESULT_INVALID)]
+    assert dict(warehouse_reg.get_warehouse_reg()["Tofu"]) == {"quantity": 5, "buy_price": 1.0}
+    assert warehouse_reg.sell_products([shop.Product("Tofu", 1)]) == [("Tofu", shop.RESULT_NO_SELL_PRICE)]
+
+
+@pytest.fixture
+def local_timezone():
+    if not hasattr(time, "tzset"):
+      pytest.skip("time.tzset is not available on this platform")
+    old_timezone = os.environ.get("TZ")
+
+    def set_timezone(name):
+        os.environ["TZ"] = name
+        time.tzset()
+
+    yield set_timezone
+    if old_timezone is None:
+      os.environ.pop("TZ", None)
+    else:
+      os.environ["TZ"] = old_timezone
+    time.tzset()
+
+
+@pytest.mark.parametrize("timezone, first_day", [("Europe/Rome", "2025-10-24"), ("Europe/Rome", "2025-03-28"),
+                                                 ("America/New_York", "2025-10-31"), ("UTC", "2025-10-24")])
+def test_totals_between_matches_the_entries_across_daylight_saving_changes(tmp_path, local_timezone, timezone, first_day):
+    local_timezone(timezone)
+    ledger = shop.Ledger(str(tmp_path / "ledger.db"))
+    first = shop.datetime.fromisoformat(first_day).timestamp()
+    last = first + 5 * 86400
+    timestamps = [first + minute * 60 for minute in range(0, 5 * 24 * 60, 7)]
+    ledger.record_sales([{"product": "Tofu", "quantity": 1, "price": 1.0, "timestamp": timestamp} for timestamp in timestamps])
+
+    boundaries = [first + second for second in range(0, int(last - first), 2333)]
+    for start_index, start in enumerate(boundaries):
+      for end in boundaries[start_index::7]:
+        expected = sum(1 for timestamp in timestamps if start <= timestamp < end)
+        assert ledger.totals_between(start, end)["revenue"] == expected, (start, end)
+
+
+def test_batch_reports_malformed_jsonl_lines_as_invalid(tmp_path):
+    operations_file = tmp_path / "operations.jsonl"
+    operations_file.write_text('{"op": "add", "product": "tofu", "quantity": 5, "buy_price": 1, "sell_price": 2}\n'
+                               '{"op": "sell", "product": \n'
+                               '[1, 2]\n'
+                               '{"op": "sell", "product": 7, "quantity": 1}\n'
+                               '{"op": "sell", "product": "tofu", "quantity": "2"}\n')
+    shop_service = shop.ShopService(new_register(tmp_path))
+
+    results = shop_service.apply_operations(shop.read_operations(str(operations_file)))
+
+    assert results == [("Tofu", shop.RESULT_OK), (None, shop.RESULT_INVALID), (None, shop.RESULT_INVALID),
+                       (None, shop.RESULT_INVALID), ("Tofu", shop.RESULT_OK)]
+    assert shop_service.list_products() == [{"product": "Tofu", "quantity": 3, "sell_price": 2}]
+
+
+def test_checkpoints_store_only_the_changed_products(tmp_path):
+    ledger = shop.Ledger(str(tmp_path / "ledger.db"), checkpoint_interval=10)
+    ledger.write_checkpoint({f"Product {number}": {"quantity": 100, "buy_price": 1.0, "sell_price": 2.0}
+                             for number in range(1000)})
+
+    stock = {"Product 1": 100, "Product 2": 100}
+    for sale in range(35):
+      product_name = "Product 1" if sale % 3 else "Product 2"
+      stock[product_name] -= 1
+      ledger.record_events([{"kind": "sale", "product": product_name, "quantity": -1, "price": 2.0,
+                             "stock": stock[product_name], "buy_price": 1.0, "sell_price": 2.0}])
+
+    rows_per_checkpoint = ledger._connection.execute(
+      "SELECT COUNT(*) FROM checkpoint_stock GROUP BY checkpoint_id ORDER BY checkpoint_id").fetchall()
+    assert rows_per_checkpoint == [(1000,), (2,), (2,), (2,)]
+
+    inventory = ledger.inventory_at(time.time())
+    assert len(inventory) == 1000
+    assert inventory["Product 1"]["quantity"] == stock["Product 1"]
+    assert inventory["Product 2"]["quantity"] == stock["Product 2"]
+    assert inventory["Product 3"]["quantity"] == 100
+    assert ledger.inventory_at(time.time(), "Product 2")["quantity"] == stock["Product 2"]
+
+
+@pytest.mark.parametrize("quantity, error", [(2 ** 70, OverflowError), (2.5, TypeError)])
+def test_inventory_store_is_unchanged_by_a_value_that_does_not_fit(quantity, error):
+    store = shop.InventoryStore({"Tofu": {"quantity": 5, "buy_price": 1.0, "sell_price": 2.0}})
+
+    with pytest.raises(error):
+      store["Big"] = {"quantity": quantity, "buy_price": 1.0, "sell_price": 2.0}
+    with pytest.raises(error):
+      store["Tofu"] = {"quantity": quantity, "buy_price": 3.0, "sell_price": 4.0}
+
+    assert store.to_dict() == {"Tofu": {"quantity": 5, "buy_price": 1.0, "sell_price": 2.0}}
+
+
+def test_add_products_in_compact_mode_rejects_quantities_above_64_bits(tmp_path):
+    warehouse_reg = new_register(tmp_path, compact=True)
+    warehouse_reg.add_products([shop.Product("Tofu", 10, 1.0, 2.0)])
+    half = shop.InventoryStore.MAX_QUANTITY // 2 + 1
+
+    results = warehouse_reg.add_products([shop.Product("Big", 2 ** 70, 1.0, 2.0), shop.Product("Tofu", half),
+                                          shop.Product("Tofu", half), shop.Product("Tofu", 1)], atomic=False)
+
+    assert [result for _, result in results] == [shop.RESULT_INVALID, shop.RESULT_OK, shop.RESULT_INVALID, shop.RESULT_OK]
+    assert "Big" not in warehouse_reg.get_warehouse_reg()
+    assert warehouse_reg.get_warehouse_reg()["Tofu"]["quantity"] == 10 + half + 1
+
+
+def test_load_records_in_shared_mode_keeps_the_changes_of_the_other_tills(tmp_path):
+    till_a = new_register(tmp_path, shared=True)
+    till_b = new_register(tmp_path, shared=True)
+    till_b.add_products([shop.Product("Seitan", 10, 1.0, 2.0)])
+
+    till_a.load_records([{"product": "Tofu", "quantity": 5, "buy_price": 1.0, "sell_price": 2.0}])
+
+    reopened = new_register(tmp_path, shared=True)
+    assert reopened.get_warehouse_reg()["Seitan"] == {"quantity": 10, "buy_price": 1.0, "sell_price": 2.0, "version": 1}
+    assert reopened.get_warehouse_reg()["Tofu"]["version"] == 1
+    assert till_a.get_warehouse_reg()["Seitan"]["quantity"] == 10
+
+
+def test_name_index_built_at_startup_follows_the_changes_of_the_register(tmp_path):
+    warehouse_reg = new_register(tmp_path, journaled=True)
+    warehouse_reg.add_products([shop.Product(f"Product {number:05d}", 1, 1.0, 2.0) for number in range(20000)])
+
+    warehouse_reg.start_name_index()
+    warehouse_reg.add_products([shop.Product("Smoked Tofu", 10, 1.0, 2.0)])
+    name_index = warehouse_reg.get_name_index()
+
+    assert len(name_index) == 20001
+    assert name_index.closest("Smoked Tofuu", limit=1) == ["Smoked Tofu"]
+    assert name_index.closest("Product 1234x", limit=3)[0].startswith("Product 1234")
+
+    with pytest.raises(RuntimeError):
+      with warehouse_reg.group_commit():
+        warehouse_reg.add_products([shop.Product("Seitan", 10, 1.0, 2.0)])
+        raise RuntimeError("flush failed")
+
+    assert warehouse_reg.get_name_index() is name_index
+    assert name_index.starting_with("Seitan") == []
+    assert name_index.starting_with("Smoked") == ["Smoked Tofu"]
+
+
+def write_journal_records(tmp_path, count):
+    warehouse_reg = new_register(tmp_path, journaled=True)
+    for number in range(count):
+      warehouse_reg.add_products([shop.Product(f"P{number}", 1, 1.0, 2.0)])
+    journal_filename = str(tmp_path / "warehouse_register.json.log")
+    with open(journal_filename, "rb") as journal_file:
+      return journal_filename, journal_file.readlines()
+
+
+def test_replay_journal_discards_a_torn_last_record(tmp_path):
+    journal_filename, lines = write_journal_records(tmp_path, 5)
+    with open(journal_filename, "wb") as journal_file:
+      journal_file.write(b"".join(lines[:4]) + lines[4][:20])
+
+    warehouse_reg = new_register(tmp_path, journaled=True)
+
+    assert sorted(warehouse_reg.get_warehouse_reg()) == ["P0", "P1", "P2", "P3"]
+    assert os.path.getsize(journal_filename) == len(b"".join(lines[:4]))
+    assert not os.path.exists(journal_filename + ".corrupt")
+
+
+def test_replay_journal_keeps_the_records_after_a_damaged_one(tmp_path):
+    journal_filename, lines = write_journal_records(tmp_path, 5)
+    damaged_journal = b"".join([lines[0], b'{"product":"P1",\n'] + lines[2:])
+    with open(journal_filename, "wb") as journal_file:
+      journal_file.write(damaged_journal)
+
+    warehouse_reg = new_register(tmp_path, journaled=True)
+
+    assert sorted(warehouse_reg.get_warehouse_reg()) == ["P0"]
+    with open(journal_filename + ".corrupt", "rb") as corrupt_file:
+      assert corrupt_file.read() == damaged_journal
+    assert os.path.getsize(journal_filename) == len(lines[0])
+
+
+@pytest.mark.skipif(shop.fcntl is None, reason="the test holds the lock with fcntl")
+def test_shared_register_loads_the_journal_under_the_lock(tmp_path):
+    till_a = new_register(tmp_path, shared=True)
+    till_a.add_products([shop.Product("Seitan", 10, 1.0, 2.0)])
+    journal_filename = str(tmp_path / "warehouse_register.json.log")
+    record = b'{"product":"Tofu","quantity":5,"buy_price":1.0,"sell_price":2.0,"version":1}\n'
+
+    opened = []
+    with open(str(tmp_path / "warehouse_register.json.lock"), "a+") as lock_file:
+      shop.fcntl.flock(lock_file.fileno(), shop.fcntl.LOCK_EX)
+      with open(journal_filename, "ab") as journal_file:
+        journal_file.write(record[:30])
+        journal_file.flush()
+        till_b_thread = threading.Thread(target=lambda: opened.append(new_register(tmp_path, shared=True)))
+        till_b_thread.start()
+        time.sleep(0.2)
+        assert not opened
+        journal_file.write(record[30:])
+      shop.fcntl.flock(lock_file.fileno(), shop.fcntl.LOCK_UN)
+    till_b_thread.join()
+
+    with open(journal_filename, "rb") as journal_file:
+      assert journal_file.read().endswith(record)
+    assert opened[0].get_warehouse_reg()["Tofu"]["quantity"] == 5
+    assert opened[0].get_warehouse_reg()["Seitan"]["quantity"] == 10